@@ -1,6 +1,7 @@
 import os
 
-modelo = "gpt-3-5-turbo-0125"
+# Misma variable que usa myapp/services/llm_service.py
+modelo = os.getenv('OPEN_API_MODEL', 'gpt-3.5-turbo')
 
 temperatura = 0
 
@@ -2,14 +2,19 @@ from flask import Flask
 from .config import Config
 from .extensions import session_ext, cors, init_db
 from .routes import init_routes
+from .utils.log_utils import init_logging
 
 def create_app():
     app = Flask(__name__, static_folder='images', static_url_path='/images')
     app.config.from_object(Config)
+    init_logging(app)
 
     # Inicializa las extensiones
     session_ext.init_app(app)
-    cors.init_app(app, supports_credentials=True, resources={r"/*": {"origins": "http://localhost:4200"}})
+    # El frontend es de otro origen: debe poder leer las cabeceras de /chat/history y /chat/chat
+    cors.init_app(app, supports_credentials=True,
+                  expose_headers=["ETag", "X-Total-Messages", "Idempotent-Replayed"],
+                  resources={r"/*": {"origins": "http://localhost:4200"}})
     init_db(app)
 
     # Registra los blueprints de rutas
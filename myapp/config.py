@@ -23,3 +23,7 @@ class Config:
     CONTEXTS_DIR = os.getenv('CONTEXTS_DIR', 'context')
 
     PIPEDRIVE_API_TOKEN = os.getenv('PIPEDRIVE_API_TOKEN')
+
+    # Logging estructurado (JSON) fuera del hilo de la petición
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.01'))
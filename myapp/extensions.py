@@ -1,6 +1,7 @@
 from flask_cors import CORS
 from flask_session import Session
 import pymongo
+from myapp.services import analytics_service, perfil_service, whatsapp_service
 
 session_ext = Session()
 cors = CORS()
@@ -9,3 +10,8 @@ def init_db(app):
     mongo_client = pymongo.MongoClient(app.config['MONGODB_URI'])
     db = mongo_client[app.config['DB_NAME']]
     app.db = db
+    # Cada turno y cada sondeo de /chat/history buscan por (user_id, session_id)
+    db.chats.create_index([('user_id', pymongo.ASCENDING), ('session_id', pymongo.ASCENDING)])
+    perfil_service.asegurar_indices(db.usuarios)
+    analytics_service.asegurar_indices(db)
+    whatsapp_service.asegurar_indices(db)
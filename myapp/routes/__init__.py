@@ -1,8 +1,12 @@
 from .chat import chat_bp
 from .usuarios import usuarios_bp
 from .pipedrive import pipedrive_bp  # Nuevo
+from .whatsapp import whatsapp_bp
+from .analytics import analytics_bp
 
 def init_routes(app):
     app.register_blueprint(chat_bp, url_prefix='/chat')
     app.register_blueprint(usuarios_bp, url_prefix='/usuarios')
     app.register_blueprint(pipedrive_bp, url_prefix='/pipedrive')
+    app.register_blueprint(whatsapp_bp)
+    app.register_blueprint(analytics_bp, url_prefix='/analytics')
@@ -0,0 +1,37 @@
+# myapp/routes/analytics.py
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, current_app
+from myapp.services.analytics_service import FORMATO_DIA, obtener_resumen, refrescar_rollups
+
+analytics_bp = Blueprint('analytics', __name__)
+
+@analytics_bp.route('/resumen', methods=['GET'])
+def resumen():
+    """
+    Devuelve los rollups diarios de leads y conversaciones.
+    Parámetros opcionales: desde, hasta (YYYY-MM-DD). Por defecto, los últimos 30 días.
+    """
+    try:
+        hoy = datetime.utcnow()
+        hasta = request.args.get('hasta', hoy.strftime(FORMATO_DIA))
+        desde = request.args.get('desde', (hoy - timedelta(days=30)).strftime(FORMATO_DIA))
+        for valor in (desde, hasta):
+            datetime.strptime(valor, FORMATO_DIA)
+    except ValueError:
+        return jsonify({"error": "Las fechas deben tener el formato YYYY-MM-DD"}), 400
+
+    try:
+        return jsonify(obtener_resumen(current_app.db, desde, hasta)), 200
+    except Exception as e:
+        current_app.logger.error("Error en el endpoint /analytics/resumen: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@analytics_bp.route('/refrescar', methods=['POST'])
+def refrescar():
+    """ Recalcula de forma incremental los rollups (pensado para lanzarse desde un cron). """
+    try:
+        resultado = refrescar_rollups(current_app.db, current_app.logger)
+        return jsonify(resultado), 200
+    except Exception as e:
+        current_app.logger.error("Error en el endpoint /analytics/refrescar: %s", e)
+        return jsonify({"error": str(e)}), 500
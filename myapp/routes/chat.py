@@ -2,20 +2,23 @@ from flask import Blueprint, request, jsonify, session, current_app
 from datetime import datetime
 import uuid
 import os
+import hashlib
 from flask_cors import CORS
 from flask import Flask
 
-from openai import OpenAI
 import difflib  # 📌 Para buscar coincidencias similares
 from myapp.utils.regex_utils import detectar_datos_usuario
 from myapp.utils.session_helpers import ensure_user_id
+from myapp.utils.idempotencia import coalescedor, clave_automatica, ConflictoIdempotencia
 from myapp.utils.data_utils import manejar_datos_usuario
-from myapp.services.woocomerce_service import WC_SITE_URL, add_to_cart, create_order_for_checkout, get_add_to_cart_url, get_cart, get_checkout_url, verificar_producto_en_carrito, obtener_productos_con_categorias
+from myapp.services.llm_service import generar_respuesta, obtener_metricas as obtener_metricas_llm
+from myapp.services.woocomerce_service import WC_SITE_URL, create_order_for_checkout, get_add_to_cart_url, get_checkout_url, obtener_productos_con_categorias
 
 chat_bp = Blueprint('chat', __name__)
+
+MAX_MENSAJES_HISTORIAL = 10000  # Límite del $slice cuando solo se indica 'since'
 app = Flask(__name__)  # 🔥 Definir app antes de usar CORS
 CORS(app, supports_credentials=True)
-client = OpenAI(api_key=os.getenv('OPEN_API_KEY'))
 
 def load_context_content(context_filename):
     safe_filename = os.path.basename(context_filename)
@@ -33,6 +36,7 @@ def procesar_mensaje(user_message, context_filename, user_id, session_id):
         # 🔍 Verificar si el usuario quiere comprar algo antes de OpenAI
         if any(palabra in user_message.lower() for palabra in ["comprar", "agregar", "carrito"]):
             respuesta_carrito = manejar_carrito(user_message)
+            registrar_intencion_carrito(user_id, session_id, context_filename)
             if respuesta_carrito and "❌" not in respuesta_carrito:
                 return {"response": f"✅ Producto agregado con éxito. Confirma aquí: {respuesta_carrito}"}
             else:
@@ -44,8 +48,10 @@ def procesar_mensaje(user_message, context_filename, user_id, session_id):
         # ✅ Extraer y guardar datos del usuario en MongoDB
         nuevos_datos = detectar_datos_usuario(user_message)
         if nuevos_datos:
-            manejar_datos_usuario(user_id, nuevos_datos, session, current_app.db.usuarios, current_app.logger)
-            enviar_a_pipedrive(user_id)
+            perfil = manejar_datos_usuario(user_id, nuevos_datos, session, current_app.db.usuarios, current_app.logger,
+                                           contexto=context_filename)
+            if perfil:
+                enviar_a_pipedrive(user_id, perfil)
 
         # ✅ Cargar contexto del chatbot
         try:
@@ -57,27 +63,17 @@ def procesar_mensaje(user_message, context_filename, user_id, session_id):
         messages = [{"role": "system", "content": context_content}] + chat_history
         messages.append({"role": "user", "content": user_message})
 
-        response = client.chat.completions.create(
-            model=os.getenv('OPEN_API_MODEL', 'gpt-3.5-turbo'),
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7
-        )
-        bot_response = response.choices[0].message.content
+        bot_response = generar_respuesta(messages, max_tokens=500, temperature=0.7)
 
         # ✅ Guardar historial de conversación en MongoDB
         chat_history.append({"role": "user", "content": user_message})
         chat_history.append({"role": "assistant", "content": bot_response})
-        current_app.db.chats.update_one(
-            {"user_id": user_id, "session_id": session_id},
-            {"$set": {"history": chat_history}},
-            upsert=True
-        )
+        guardar_historial(user_id, session_id, chat_history, context_filename)
 
         return {"response": bot_response}
 
     except Exception as e:
-        current_app.logger.error(f"❌ Error en procesar_mensaje: {e}")
+        current_app.logger.exception("❌ Error en procesar_mensaje: %s", e)
         return {"error": str(e)}
 
 @chat_bp.before_request
@@ -91,9 +87,9 @@ def set_session_permanent():
         if existing_chat:
             session['session_id'] = existing_chat["session_id"]  # Recuperar la sesión existente
 
-        current_app.logger.info(f"🆕 Nueva session_id creada: {session['session_id']}")
+        current_app.logger.info("🆕 Nueva session_id creada: %s", session['session_id'])
     else:
-        current_app.logger.info(f"♻️ Sesión existente: {session['session_id']}")
+        current_app.logger.debug("♻️ Sesión existente: %s", session['session_id'])
 
 from myapp.utils.regex_utils import detectar_producto_y_cantidad
 from myapp.services.woocomerce_service import get_add_to_cart_url
@@ -104,9 +100,8 @@ import requests
 @chat_bp.route('/ver_cookies', methods=['GET'])
 def ver_cookies():
     cookies = request.cookies
-    print(f"📢 Cookies recibidas en Flask: {cookies}")
-    print(f"📢 Estado actual de la sesión: {session}")  # Agregar antes del return
-      # Debug en consola del servidor
+    current_app.logger.debug("📢 Cookies recibidas en Flask: %s", cookies)
+    current_app.logger.debug("📢 Estado actual de la sesión: %s", session)
     return jsonify({"cookies_recibidas": dict(cookies)})
 
 
@@ -115,19 +110,18 @@ def ver_cookies():
 def guardar_sesion():
     # 🔍 Mostrar todas las cookies recibidas
     cookies = request.cookies
-    current_app.logger.info(f"📢 Cookies recibidas en el servidor: {cookies}")
-    print(f"📢 Cookies recibidas en Flask: {cookies}")  # Debug en consola del servidor
+    current_app.logger.debug("📢 Cookies recibidas en el servidor: %s", cookies)
 
     # Buscar la cookie de WooCommerce
     woocommerce_session = request.cookies.get('wp_woocommerce_session')
     
     if woocommerce_session:
         session['wp_woocommerce_session'] = woocommerce_session
-        print(f"📢 Estado actual de la sesión: {session}")  # Agregar antes del return
+        current_app.logger.debug("📢 Estado actual de la sesión: %s", session)
 
         return jsonify({"mensaje": "✅ Sesión de WooCommerce guardada correctamente"}), 200
     else:
-        current_app.logger.info(f"📢 Estado actual de la sesión: {session}")  # Agregar antes del return
+        current_app.logger.debug("📢 Estado actual de la sesión: %s", session)
         return jsonify({
         "error": "⚠️ No se encontró la sesión de WooCommerce en las cookies",
         "cookies_recibidas": dict(cookies)  # 🔍 Corrección: Añadir una coma y convertir cookies a dict
@@ -158,25 +152,82 @@ def manejar_carrito(user_message):
     return cart_url  # 🔥 Ahora solo devolvemos la URL
 
 
-def get_chat_history(user_id, session_id):
-    """ Recupera el historial de chat desde MongoDB """
+def get_chat_history(user_id, session_id, since=0, limit=None):
+    """
+    Recupera el historial de chat desde MongoDB.
+    Con 'since'/'limit' se usa una proyección $slice para leer solo ese tramo.
+    """
     chats_collection = current_app.db.chats
-    conversation = chats_collection.find_one({"user_id": user_id, "session_id": session_id})
-    
+    projection = {"_id": 0, "history": 1}
+    if since or limit:
+        projection = {"_id": 0, "history": {"$slice": [since, limit or MAX_MENSAJES_HISTORIAL]}}
+    conversation = chats_collection.find_one({"user_id": user_id, "session_id": session_id}, projection)
+
     if conversation and "history" in conversation:
         return conversation["history"]  # Devolver historial existente
     return []  # Si no hay historial, devolver lista vacía
 
+def contar_mensajes(user_id, session_id):
+    """ Número de mensajes del historial, calculado en MongoDB sin transferir el historial """
+    resultado = list(current_app.db.chats.aggregate([
+        {"$match": {"user_id": user_id, "session_id": session_id}},
+        {"$limit": 1},
+        {"$project": {"_id": 0, "mensajes": {"$size": {"$ifNull": ["$history", []]}}}}
+    ]))
+    return resultado[0]["mensajes"] if resultado else 0
+
+def posicion_conversacion(user_id, session_id):
+    """
+    Turnos ya procesados en la conversación: mensajes del historial más turnos
+    de carrito (que no se guardan en el historial). Cambia con cada turno
+    completado, así un mensaje repetido a propósito genera otra clave automática.
+    """
+    resultado = list(current_app.db.chats.aggregate([
+        {"$match": {"user_id": user_id, "session_id": session_id}},
+        {"$limit": 1},
+        {"$project": {"_id": 0,
+                      "mensajes": {"$size": {"$ifNull": ["$history", []]}},
+                      "intenciones_carrito": {"$ifNull": ["$intenciones_carrito", 0]}}}
+    ]))
+    if not resultado:
+        return "0:0"
+    return f"{resultado[0]['mensajes']}:{resultado[0]['intenciones_carrito']}"
+
+def guardar_historial(user_id, session_id, chat_history, contexto):
+    """ Guarda el historial y las marcas de tiempo que usan los rollups de analytics """
+    ahora = datetime.utcnow()
+    current_app.db.chats.update_one(
+        {"user_id": user_id, "session_id": session_id},
+        {"$set": {"history": chat_history, "contexto": contexto, "actualizado": ahora},
+         "$setOnInsert": {"creado": ahora}},
+        upsert=True
+    )
+
+def registrar_intencion_carrito(user_id, session_id, contexto):
+    """ Cuenta los turnos con intención de compra en la conversación """
+    ahora = datetime.utcnow()
+    current_app.db.chats.update_one(
+        {"user_id": user_id, "session_id": session_id},
+        {"$inc": {"intenciones_carrito": 1},
+         "$set": {"contexto": contexto, "actualizado": ahora},
+         "$setOnInsert": {"creado": ahora}},
+        upsert=True
+    )
+
 from myapp.services.pipedrive_service import create_person, create_deal
+from myapp.services.perfil_service import obtener_perfil, guardar_perfil, fijar_campos
 
-def enviar_a_pipedrive(user_id):
-    """ Envía los datos del usuario a Pipedrive si tiene la información necesaria """
+def enviar_a_pipedrive(user_id, perfil=None):
+    """
+    Envía los datos del usuario a Pipedrive si tiene la información necesaria.
+    Si se recibe el perfil recién guardado se evita volver a leerlo de MongoDB.
+    """
     try:
-        current_app.logger.info(f"📤 Intentando enviar datos del usuario {user_id} a Pipedrive...")
+        current_app.logger.info("📤 Intentando enviar datos del usuario %s a Pipedrive...", user_id)
 
-        usuario = current_app.db.usuarios.find_one({"user_id": user_id}, {"_id": 0})
+        usuario = perfil or obtener_perfil(user_id, current_app.db.usuarios)
         if not usuario:
-            current_app.logger.warning(f"⚠️ No se encontraron datos en MongoDB para el usuario {user_id}")
+            current_app.logger.warning("⚠️ No se encontraron datos en MongoDB para el usuario %s", user_id)
             return
 
         # ✅ Verificar que el usuario tiene la información completa
@@ -186,7 +237,7 @@ def enviar_a_pipedrive(user_id):
         motivo_visita = usuario.get("motivo_visita")
 
         if not (nombre and email and motivo_visita):
-            current_app.logger.warning(f"⚠️ Faltan datos para enviar a Pipedrive (nombre, email o motivo_visita).")
+            current_app.logger.warning("⚠️ Faltan datos para enviar a Pipedrive (nombre, email o motivo_visita).")
             return
 
         # ✅ Verificar si ya tiene un deal_id
@@ -201,7 +252,7 @@ def enviar_a_pipedrive(user_id):
                 "email": email,
                 "phone": telefono
             }
-            current_app.logger.info(f"🛠️ Creando persona en Pipedrive con datos: {person_data}")
+            current_app.logger.debug("🛠️ Creando persona en Pipedrive con datos: %s", person_data)
             person_response = create_person(person_data)
             person_id = person_response.get("data", {}).get("id")
 
@@ -216,19 +267,60 @@ def enviar_a_pipedrive(user_id):
                 new_deal_id = deal_response.get("data", {}).get("id")
 
                 if new_deal_id:
-                    # Guardar el deal_id en MongoDB
-                    current_app.db.usuarios.update_one(
-                        {"user_id": user_id},
-                        {"$set": {"deal_id": new_deal_id}}
-                    )
-                    current_app.logger.info(f"✅ Nuevo negocio creado en Pipedrive: {new_deal_id}")
+                    # Guardar el deal_id en el perfil (MongoDB + caché). Si se pierde,
+                    # el siguiente turno crearía un negocio duplicado en Pipedrive.
+                    try:
+                        guardar_perfil(user_id, {"deal_id": new_deal_id}, current_app.db.usuarios, current_app.logger)
+                    except RuntimeError:
+                        current_app.logger.warning("⚠️ Conflictos de versión guardando deal_id %s; escritura atómica.", new_deal_id)
+                        fijar_campos(user_id, {"deal_id": new_deal_id}, current_app.db.usuarios)
+                    current_app.logger.info("✅ Nuevo negocio creado en Pipedrive: %s", new_deal_id)
                 else:
                     current_app.logger.error("❌ No se pudo obtener el deal_id al crear el nuevo negocio.")
             else:
                 current_app.logger.error("❌ No se pudo crear la persona en Pipedrive.")
 
     except Exception as e:
-        current_app.logger.error(f"❌ Error enviando datos a Pipedrive: {e}")
+        current_app.logger.exception("❌ Error enviando datos a Pipedrive: %s", e)
+
+def responder_chat(user_message, context_filename, user_id, session_id):
+    """ Genera la respuesta de un turno de /chat/chat. Devuelve (payload, status). """
+    # 🔍 Si el mensaje es sobre carrito, devolvemos la URL directamente
+    if any(palabra in user_message.lower() for palabra in ["comprar", "agregar", "carrito"]):
+        cart_url = manejar_carrito(user_message)
+        registrar_intencion_carrito(user_id, session_id, context_filename)
+        return {"response":" ✅ Producto Agregado Al carrito con exito, haz click para confirmar.", "url": cart_url}, 200  # 🔥 Ahora solo devolvemos la URL
+
+    # ✅ Recuperar historial de conversación
+    chat_history = get_chat_history(user_id, session_id)
+
+    # ✅ Extraer y guardar datos del usuario en MongoDB
+    nuevos_datos = detectar_datos_usuario(user_message)
+    if nuevos_datos:
+        current_app.logger.debug("🛠️ Datos nuevos detectados: %s", nuevos_datos)
+        perfil = manejar_datos_usuario(user_id, nuevos_datos, session, current_app.db.usuarios, current_app.logger,
+                                       contexto=context_filename)
+        if perfil:
+            enviar_a_pipedrive(user_id, perfil)
+
+    # ✅ Cargar contexto del chatbot
+    try:
+        context_content = load_context_content(context_filename)
+    except FileNotFoundError as e:
+        return {"error": str(e)}, 400
+
+    # ✅ Generar respuesta con OpenAI
+    messages = [{"role": "system", "content": context_content}] + chat_history
+    messages.append({"role": "user", "content": user_message})
+
+    bot_response = generar_respuesta(messages, max_tokens=500, temperature=0.7)
+
+    # ✅ Guardar historial de conversación
+    chat_history.append({"role": "user", "content": user_message})
+    chat_history.append({"role": "assistant", "content": bot_response})
+    guardar_historial(user_id, session_id, chat_history, context_filename)
+
+    return {'response': bot_response}, 200
 
 @chat_bp.route('/chat', methods=['POST'])
 def chat():
@@ -246,52 +338,35 @@ def chat():
         user_id = session['user_id']
         session_id = session['session_id']
 
-        # 🔍 Si el mensaje es sobre carrito, devolvemos la URL directamente
-        if any(palabra in user_message.lower() for palabra in ["comprar", "agregar", "carrito"]):
-            cart_url = manejar_carrito(user_message)
-            return jsonify({"response":" ✅ Producto Agregado Al carrito con exito, haz click para confirmar.", "url": cart_url})  # 🔥 Ahora solo devolvemos la URL
-
-        # ✅ Recuperar historial de conversación
-        chat_history = get_chat_history(user_id, session_id)
-
-        # ✅ Extraer y guardar datos del usuario en MongoDB
-        nuevos_datos = detectar_datos_usuario(user_message)
-        if nuevos_datos:
-            current_app.logger.info(f"🛠️ Datos nuevos detectados: {nuevos_datos}")
-            manejar_datos_usuario(user_id, nuevos_datos, session, current_app.db.usuarios, current_app.logger)
-            enviar_a_pipedrive(user_id)
+        # 🔁 Dobles clics, reintentos del frontend: misma clave => un solo cálculo.
+        # La clave automática solo coalesce peticiones del mismo turno; para reproducir
+        # la respuesta de un turno ya terminado el cliente debe enviar Idempotency-Key.
+        huella = clave_automatica(context_filename, user_message)
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key:
+            clave = f"chat:{session_id}:{idempotency_key}"
+        else:
+            clave = "chat:" + clave_automatica(session_id, context_filename, user_message,
+                                               posicion_conversacion(user_id, session_id))
 
-        # ✅ Cargar contexto del chatbot
         try:
-            context_content = load_context_content(context_filename)
-        except FileNotFoundError as e:
-            return jsonify({"error": str(e)}), 400
-
-        # ✅ Generar respuesta con OpenAI
-        messages = [{"role": "system", "content": context_content}] + chat_history
-        messages.append({"role": "user", "content": user_message})
-
-        response = client.chat.completions.create(
-            model=os.getenv('OPEN_API_MODEL', 'gpt-3.5-turbo'),
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7
-        )
-        bot_response = response.choices[0].message.content
-
-        # ✅ Guardar historial de conversación
-        chat_history.append({"role": "user", "content": user_message})
-        chat_history.append({"role": "assistant", "content": bot_response})
-        current_app.db.chats.update_one(
-            {"user_id": user_id, "session_id": session_id},
-            {"$set": {"history": chat_history}},
-            upsert=True
-        )
-
-        return jsonify({'response': bot_response}), 200
+            (payload, status), deduplicado = coalescedor.ejecutar(
+                clave,
+                lambda: responder_chat(user_message, context_filename, user_id, session_id),
+                cacheable=lambda resultado: resultado[1] < 500,
+                huella=huella
+            )
+        except ConflictoIdempotencia:
+            return jsonify({"error": "La Idempotency-Key ya se usó con otro mensaje o contexto"}), 422
+        if deduplicado:
+            current_app.logger.info("🔁 Petición duplicada en /chat servida sin recalcular", extra={"session_id": session_id})
+
+        response = jsonify(payload)
+        response.headers['Idempotent-Replayed'] = 'true' if deduplicado else 'false'
+        return response, status
 
     except Exception as e:
-        current_app.logger.error(f"❌ Error en /chat: {e}")
+        current_app.logger.exception("❌ Error en /chat: %s", e)
         return jsonify({'error': str(e)}), 500
 
 from flask import request, jsonify
@@ -304,7 +379,7 @@ def recibir_sesion():
         return jsonify({"error": "No se recibió sesión de WooCommerce"}), 400
 
     session['wp_woocommerce_session'] = request.json['wp_woocommerce_session']
-    print("📡 Sesión de WooCommerce recibida:", session['wp_woocommerce_session'])  # Debugging
+    current_app.logger.debug("📡 Sesión de WooCommerce recibida: %s", session['wp_woocommerce_session'])
 
     return jsonify({"message": "Sesión guardada correctamente"}), 200
 
@@ -325,14 +400,40 @@ def check_session():
     
 @chat_bp.route('/history', methods=['GET'])
 def get_history():
-    """ Recupera el historial de la conversación del usuario """
+    """
+    Recupera el historial de la conversación del usuario.
+    Pagina por mensajes (no por turnos): since (índice del primer mensaje) y limit.
+    Devuelve un ETag basado en el número de mensajes y responde 304 si no hubo cambios.
+    """
     ensure_user_id(session)
     user_id = session['user_id']
     session_id = session['session_id']
 
-    chat_history = get_chat_history(user_id, session_id)
-
-    return jsonify({'history': chat_history})
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    if since < 0 or (limit is not None and limit <= 0):
+        return jsonify({"error": "'since' debe ser >= 0 y 'limit' > 0"}), 400
+
+    total = contar_mensajes(user_id, session_id)
+    # El ETag no expone el session_id interno
+    sesion_hash = hashlib.sha256(session_id.encode('utf-8')).hexdigest()[:16]
+    etag = f"{sesion_hash}:{total}:{since}:{limit}"
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        chat_history = get_chat_history(user_id, session_id, since, limit) if since < total else []
+        response = jsonify({'history': chat_history, 'total': total, 'since': since,
+                            'next': since + len(chat_history)})
+
+    response.set_etag(etag, weak=True)
+    response.headers['X-Total-Messages'] = str(total)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@chat_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """ Métricas de las llamadas al modelo y de las peticiones deduplicadas """
+    return jsonify({'llm': obtener_metricas_llm(), 'idempotencia': coalescedor.metricas()}), 200
 
 @chat_bp.route('/reset', methods=['POST'])
 def reset_chat():
@@ -1,4 +1,6 @@
 from flask import Blueprint, request, jsonify, current_app
+import hashlib
+import hmac
 import requests
 import os
 from openai import OpenAI
@@ -6,18 +8,31 @@ import uuid
 from myapp.routes.chat import procesar_mensaje
 
 from myapp.routes.chat import chat 
+from myapp.services.whatsapp_service import get_sender, reclamar_mensaje
 
 whatsapp_bp = Blueprint('whatsapp', __name__)
 
 WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
 PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
-WHATSAPP_VERIFY_TOKEN = "futurito123"
+WHATSAPP_VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN")
+WHATSAPP_APP_SECRET = os.getenv("WHATSAPP_APP_SECRET")
+
+def firma_valida(cuerpo, firma):
+    """Comprueba la cabecera X-Hub-Signature-256 (HMAC-SHA256 del cuerpo con el App Secret de Meta)"""
+    if not WHATSAPP_APP_SECRET or not firma or not firma.startswith("sha256="):
+        return False
+    esperada = hmac.new(WHATSAPP_APP_SECRET.encode("utf-8"), cuerpo, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(esperada, firma[len("sha256="):])
 
 @whatsapp_bp.route('/whatsapp/webhook', methods=['POST'])
 def receive_message():
     """Recibe mensajes de WhatsApp y los procesa con la lógica del chatbot"""
-    data = request.get_json()
-    print("📩 Mensaje recibido:", data)
+    if not firma_valida(request.get_data(), request.headers.get("X-Hub-Signature-256")):
+        current_app.logger.warning("⚠️ Webhook de WhatsApp rechazado: firma ausente o inválida")
+        return "Forbidden", 403
+
+    data = request.get_json(silent=True) or {}
+    current_app.logger.debug("📩 Mensaje recibido: %s", data)
 
     if "entry" in data:
         for entry in data["entry"]:
@@ -30,12 +45,19 @@ def receive_message():
                         user_id = sender_number  
                         session_id = f"whatsapp_{user_id}_{uuid.uuid4().hex[:8]}"  # 🔥 Evita colisiones de sesión
 
-                        print(f"🆔 Nuevo mensaje de {user_id} con session_id {session_id}")
+                        current_app.logger.info("🆔 Nuevo mensaje de WhatsApp", extra={"wa_user": user_id, "session_id": session_id})
+
+                        # 🔁 Meta reenvía el mismo mensaje (mismo id) si no recibe el 200 a tiempo
+                        mensaje_id = message.get("id")
+                        if mensaje_id and not reclamar_mensaje(current_app.db, mensaje_id):
+                            current_app.logger.info("🔁 Mensaje de WhatsApp %s ya procesado, no se reenvía", mensaje_id)
+                            get_sender(PHONE_NUMBER_ID).registrar_reenvio_descartado()
+                            continue
 
                         response_data = procesar_mensaje(user_text, "robota-context", user_id, session_id)
                         bot_response = response_data.get("response", "No se pudo procesar tu mensaje.")
 
-                        print(f"🛠️ Mensaje procesado para {user_id}: {bot_response}")
+                        current_app.logger.debug("🛠️ Mensaje procesado para %s: %s", user_id, bot_response)
 
                         send_whatsapp_message(sender_number, bot_response)
 
@@ -43,13 +65,13 @@ def receive_message():
 
 
 def send_whatsapp_message(phone, message):
-    """Envía un mensaje de WhatsApp usando la API de Meta"""
-    url = f"https://graph.facebook.com/v17.0/{PHONE_NUMBER_ID}/messages"
-    headers = {"Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}", "Content-Type": "application/json"}
-    payload = {"messaging_product": "whatsapp", "to": phone, "text": {"body": message}}
+    """Encola el envío de un mensaje de WhatsApp usando la API de Meta"""
+    return get_sender(PHONE_NUMBER_ID).enviar_en_segundo_plano(phone, message)
 
-    response = requests.post(url, json=payload, headers=headers)
-    print(f"📤 Respuesta enviada a {phone}: {response.json()}")
+@whatsapp_bp.route('/whatsapp/metrics', methods=['GET'])
+def metrics():
+    """Métricas de envío: contadores y latencia de la API de Meta"""
+    return jsonify(get_sender(PHONE_NUMBER_ID).metricas()), 200
 
 @whatsapp_bp.route('/whatsapp/webhook', methods=['GET'])
 def verify():
@@ -58,6 +80,6 @@ def verify():
     token = request.args.get("hub.verify_token")
     challenge = request.args.get("hub.challenge")
 
-    if mode == "subscribe" and token == WHATSAPP_VERIFY_TOKEN:
+    if mode == "subscribe" and WHATSAPP_VERIFY_TOKEN and token == WHATSAPP_VERIFY_TOKEN:
         return challenge, 200  
     return "Forbidden", 403  
@@ -0,0 +1,155 @@
+# myapp/services/analytics_service.py
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING
+
+ROLLUP_LEADS = 'analytics_leads_diario'
+ROLLUP_CONVERSACIONES = 'analytics_conversaciones_diario'
+ESTADO = 'analytics_estado'
+FORMATO_DIA = '%Y-%m-%d'
+
+# Rangos de la distribución de longitud de conversación (turnos del usuario)
+RANGOS_TURNOS = [(0, '0'), (2, '1-2'), (5, '3-5'), (10, '6-10'), (20, '11-20')]
+RANGO_MAXIMO = '21+'
+
+
+def asegurar_indices(db):
+    """ Índices que mantienen acotado el coste de cada refresco incremental. """
+    db.usuarios.create_index([('actualizado', ASCENDING)])
+    db.chats.create_index([('actualizado', ASCENDING)])
+    db.chats.create_index([('creado', ASCENDING)])
+    db[ROLLUP_LEADS].create_index([('dia', ASCENDING)])
+    db[ROLLUP_CONVERSACIONES].create_index([('dia', ASCENDING)])
+
+
+def _dia(campo):
+    return {'$dateToString': {'format': FORMATO_DIA, 'date': f'${campo}'}}
+
+
+def _dias_afectados(coleccion, campo_fecha, desde):
+    """ Días (según 'campo_fecha') de los documentos modificados desde la última ejecución. """
+    filtro = {campo_fecha: {'$type': 'date'}}
+    if desde is not None:
+        filtro['actualizado'] = {'$gte': desde}
+    return sorted(d['_id'] for d in coleccion.aggregate([
+        {'$match': filtro},
+        {'$group': {'_id': _dia(campo_fecha)}},
+    ]))
+
+
+def _filtro_dias(campo_fecha, dias):
+    rangos = []
+    for dia in dias:
+        inicio = datetime.strptime(dia, FORMATO_DIA)
+        rangos.append({campo_fecha: {'$gte': inicio, '$lt': inicio + timedelta(days=1)}})
+    return {'$or': rangos}
+
+
+def _rango_turnos():
+    ramas = [{'case': {'$lte': ['$turnos', limite]}, 'then': etiqueta} for limite, etiqueta in RANGOS_TURNOS]
+    return {'$switch': {'branches': ramas, 'default': RANGO_MAXIMO}}
+
+
+def _pipeline_leads(dias, ahora):
+    return [
+        {'$match': _filtro_dias('fecha_registro', dias)},
+        {'$group': {
+            '_id': {'dia': _dia('fecha_registro'), 'contexto': {'$ifNull': ['$contexto', 'desconocido']}},
+            'leads': {'$sum': 1},
+            'convertidos_pipedrive': {'$sum': {'$cond': [{'$ifNull': ['$deal_id', False]}, 1, 0]}},
+        }},
+        {'$set': {'dia': '$_id.dia', 'contexto': '$_id.contexto', 'actualizado': ahora}},
+        {'$merge': {'into': ROLLUP_LEADS, 'on': '_id', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+    ]
+
+
+def _pipeline_conversaciones(dias, ahora):
+    return [
+        {'$match': _filtro_dias('creado', dias)},
+        {'$project': {
+            'dia': _dia('creado'),
+            'turnos': {'$floor': {'$divide': [{'$size': {'$ifNull': ['$history', []]}}, 2]}},
+            'carrito': {'$gt': [{'$ifNull': ['$intenciones_carrito', 0]}, 0]},
+        }},
+        {'$group': {
+            '_id': {'dia': '$dia', 'rango': _rango_turnos()},
+            'conversaciones': {'$sum': 1},
+            'con_intencion_carrito': {'$sum': {'$cond': ['$carrito', 1, 0]}},
+            'turnos': {'$sum': '$turnos'},
+        }},
+        {'$group': {
+            '_id': '$_id.dia',
+            'conversaciones': {'$sum': '$conversaciones'},
+            'con_intencion_carrito': {'$sum': '$con_intencion_carrito'},
+            'turnos_totales': {'$sum': '$turnos'},
+            'distribucion_turnos': {'$push': {'k': '$_id.rango', 'v': '$conversaciones'}},
+        }},
+        {'$set': {
+            'dia': '$_id',
+            'distribucion_turnos': {'$arrayToObject': '$distribucion_turnos'},
+            'actualizado': ahora,
+        }},
+        {'$merge': {'into': ROLLUP_CONVERSACIONES, 'on': '_id', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+    ]
+
+
+def _completar_fechas_chats(db, ahora):
+    """
+    Los chats guardados antes de los rollups no tienen 'creado': se toma la
+    fecha de creación de su ObjectId y se marcan como modificados para que el
+    refresco en curso los incluya.
+    """
+    return db.chats.update_many(
+        {'creado': {'$exists': False}},
+        [{'$set': {'creado': {'$toDate': '$_id'}, 'actualizado': ahora}}]
+    ).modified_count
+
+
+def refrescar_rollups(db, logger):
+    """
+    Actualiza los rollups diarios de forma incremental: solo se recalculan (con
+    $merge) los días que contienen documentos modificados desde la última
+    ejecución. Antes se borran las filas de esos días, para que desaparezcan
+    los grupos que ya no existen. Es idempotente y puede lanzarse desde un cron.
+    """
+    ahora = datetime.utcnow()
+    estado = db[ESTADO].find_one({'_id': 'rollups'}) or {}
+    desde = estado.get('hasta')
+
+    completados = _completar_fechas_chats(db, ahora)
+    if completados:
+        logger.info("📊 %d chat(s) antiguos sin 'creado' completados con la fecha de su _id", completados)
+
+    dias_leads = _dias_afectados(db.usuarios, 'fecha_registro', desde)
+    if dias_leads:
+        db[ROLLUP_LEADS].delete_many({'dia': {'$in': dias_leads}})
+        db.usuarios.aggregate(_pipeline_leads(dias_leads, ahora))
+
+    dias_conversaciones = _dias_afectados(db.chats, 'creado', desde)
+    if dias_conversaciones:
+        db[ROLLUP_CONVERSACIONES].delete_many({'dia': {'$in': dias_conversaciones}})
+        db.chats.aggregate(_pipeline_conversaciones(dias_conversaciones, ahora))
+
+    db[ESTADO].update_one({'_id': 'rollups'}, {'$set': {'hasta': ahora}}, upsert=True)
+    logger.info("📊 Rollups actualizados: %d día(s) de leads, %d día(s) de conversaciones",
+                len(dias_leads), len(dias_conversaciones))
+    return {'dias_leads': dias_leads, 'dias_conversaciones': dias_conversaciones}
+
+
+def _tasa(parte, total):
+    return round(parte / total, 4) if total else None
+
+
+def obtener_resumen(db, desde, hasta):
+    """ Lee los rollups entre dos días (YYYY-MM-DD, inclusive) sin tocar las colecciones crudas. """
+    filtro = {'dia': {'$gte': desde, '$lte': hasta}}
+
+    leads = list(db[ROLLUP_LEADS].find(filtro, {'_id': 0}).sort('dia', ASCENDING))
+    for fila in leads:
+        fila['tasa_conversion_pipedrive'] = _tasa(fila['convertidos_pipedrive'], fila['leads'])
+
+    conversaciones = list(db[ROLLUP_CONVERSACIONES].find(filtro, {'_id': 0}).sort('dia', ASCENDING))
+    for fila in conversaciones:
+        fila['tasa_intencion_carrito'] = _tasa(fila['con_intencion_carrito'], fila['conversaciones'])
+
+    return {'leads': leads, 'conversaciones': conversaciones}
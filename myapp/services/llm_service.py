@@ -0,0 +1,253 @@
+# myapp/services/llm_service.py
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError, OpenAI, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+# OPEN_API_BASE_URL permite apuntar a un stub local compatible con OpenAI
+client = OpenAI(
+    api_key=os.getenv('OPEN_API_KEY'),
+    base_url=os.getenv('OPEN_API_BASE_URL') or None,
+    max_retries=0,  # Los reintentos los gestiona este módulo (hedging + fallback)
+)
+
+MODELO_PRINCIPAL = os.getenv('OPEN_API_MODEL', 'gpt-3.5-turbo')
+MODELO_FALLBACK = os.getenv('OPEN_API_FALLBACK_MODEL')
+DEADLINE_SEGUNDOS = float(os.getenv('LLM_DEADLINE', '20'))
+# Segundos antes de lanzar la petición de respaldo; vacío = p95 observado
+HEDGE_DESPUES_DE = os.getenv('LLM_HEDGE_AFTER')
+HEDGE_HABILITADO = os.getenv('LLM_HEDGE', '1') == '1'
+MIN_MUESTRAS_HEDGE = 20
+# Fracción máxima de llamadas (de las últimas VENTANA_HEDGE) que pueden lanzar hedge
+MAX_TASA_HEDGE = float(os.getenv('LLM_HEDGE_MAX_RATE', '0.1'))
+VENTANA_HEDGE = 200
+FALLOS_PARA_ABRIR = int(os.getenv('LLM_CB_FAILURES', '5'))
+ENFRIAMIENTO_SEGUNDOS = float(os.getenv('LLM_CB_COOLDOWN', '30'))
+# Peticiones concurrentes que atiende cada proceso (hilos de gunicorn)
+CONCURRENCIA = int(os.getenv('LLM_CONCURRENCY', '16'))
+
+# Dos hilos por petición (la original y su hedge) para que ninguna llamada
+# espere en la cola del executor consumiendo su deadline. Las llamadas
+# abandonadas terminan como tarde al vencer ese mismo deadline.
+_executor = ThreadPoolExecutor(max_workers=2 * CONCURRENCIA, thread_name_prefix='llm')
+_lock = threading.Lock()
+_latencias = defaultdict(lambda: deque(maxlen=200))
+_hedges = defaultdict(lambda: deque(maxlen=VENTANA_HEDGE))  # True si la llamada lanzó hedge
+_resultados = defaultdict(lambda: defaultdict(int))
+
+
+class CircuitBreaker:
+    """
+    Abre el circuito tras 'umbral' fallos consecutivos. Pasado el enfriamiento
+    deja pasar una única llamada de prueba (half-open) antes de cerrarlo.
+    """
+
+    def __init__(self, umbral, enfriamiento):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self.fallos = 0
+        self.abierto_desde = None
+        self.probando = False
+        self.lock = threading.Lock()
+
+    def permite(self):
+        with self.lock:
+            if self.abierto_desde is None:
+                return True
+            if not self.probando and time.monotonic() - self.abierto_desde >= self.enfriamiento:
+                self.probando = True
+                return True
+            return False
+
+    def exito(self):
+        with self.lock:
+            self.fallos = 0
+            self.abierto_desde = None
+            self.probando = False
+
+    def fallo(self):
+        with self.lock:
+            self.fallos += 1
+            if self.probando or self.fallos >= self.umbral:
+                self.abierto_desde = time.monotonic()
+            self.probando = False
+
+    @property
+    def estado(self):
+        with self.lock:
+            return 'cerrado' if self.abierto_desde is None else 'abierto'
+
+
+_circuitos = defaultdict(lambda: CircuitBreaker(FALLOS_PARA_ABRIR, ENFRIAMIENTO_SEGUNDOS))
+
+
+def _registrar(modelo, resultado):
+    with _lock:
+        _resultados[modelo][resultado] += 1
+
+
+def _registrar_latencia(modelo, latencia):
+    with _lock:
+        _latencias[modelo].append(latencia)
+
+
+def _umbral_hedge(modelo):
+    """
+    Segundos a esperar antes de lanzar la segunda petición, o None si no hay
+    hedging (deshabilitado o ya se alcanzó MAX_TASA_HEDGE en la ventana).
+    """
+    if not HEDGE_HABILITADO:
+        return None
+    with _lock:
+        ventana = _hedges[modelo]
+        if ventana and sum(ventana) >= MAX_TASA_HEDGE * len(ventana):
+            return None
+    if HEDGE_DESPUES_DE:
+        return float(HEDGE_DESPUES_DE)
+    return _p95(modelo, MIN_MUESTRAS_HEDGE)
+
+
+def _p95(modelo, min_muestras=1):
+    with _lock:
+        muestras = sorted(_latencias[modelo])
+    if len(muestras) < min_muestras:
+        return None
+    return muestras[int(0.95 * (len(muestras) - 1))]
+
+
+def _invocar(modelo, messages, max_tokens, temperature, timeout):
+    return client.chat.completions.create(
+        model=modelo,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        timeout=timeout,
+    )
+
+
+def _es_timeout(error):
+    return isinstance(error, (TimeoutError, APITimeoutError))
+
+
+def _es_fallo_del_proveedor(error):
+    """
+    Solo los timeouts, errores de conexión, 429 y 5xx indican que el modelo no
+    está disponible. Los 4xx (contexto demasiado largo, autenticación...) son
+    errores de la petición: no abren el circuito ni justifican el fallback.
+    """
+    if isinstance(error, (TimeoutError, APIConnectionError, RateLimitError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+def _llamar_modelo(modelo, messages, max_tokens, temperature, fin):
+    """
+    Llama al modelo sin pasar del instante 'fin' (time.monotonic). Si la primera
+    petición supera el umbral de hedging se lanza una segunda idéntica y gana la
+    primera que responda. La latencia registrada es siempre la de la primera
+    petición (aunque gane el hedge), para que el p95 que fija el umbral no baje
+    por efecto del propio hedging.
+    """
+    inicio = time.monotonic()
+    deadline = fin - inicio
+    principal = _executor.submit(_invocar, modelo, messages, max_tokens, temperature, deadline)
+
+    def medir(futuro):
+        if futuro.exception() is None:
+            _registrar_latencia(modelo, time.monotonic() - inicio)
+
+    principal.add_done_callback(medir)
+    pendientes = {principal}
+
+    umbral = _umbral_hedge(modelo)
+    hedge = False
+    if umbral is not None and umbral < deadline:
+        hechos, _ = wait(pendientes, timeout=umbral)
+        if not hechos:
+            restante = fin - time.monotonic()
+            pendientes.add(_executor.submit(_invocar, modelo, messages, max_tokens, temperature, restante))
+            _registrar(modelo, 'hedge')
+            hedge = True
+    with _lock:
+        _hedges[modelo].append(hedge)
+
+    ultimo_error = None
+    while pendientes:
+        restante = fin - time.monotonic()
+        if restante <= 0:
+            break
+        hechos, pendientes = wait(pendientes, timeout=restante, return_when=FIRST_COMPLETED)
+        for futuro in hechos:
+            if futuro.exception() is None:
+                _registrar(modelo, 'ok')
+                return futuro.result()
+            ultimo_error = futuro.exception()
+            if not _es_fallo_del_proveedor(ultimo_error):
+                raise ultimo_error
+
+    if pendientes:
+        raise TimeoutError(f"El modelo {modelo} no respondió en {deadline:.1f}s")
+    raise ultimo_error
+
+
+def generar_respuesta(messages, max_tokens=500, temperature=0.7, deadline=None):
+    """
+    Genera la respuesta del chatbot con el modelo principal y, si su circuito
+    está abierto o el proveedor falla, con el modelo de respaldo
+    (OPEN_API_FALLBACK_MODEL). El deadline cubre todos los intentos.
+    """
+    fin = time.monotonic() + (deadline or DEADLINE_SEGUNDOS)
+    modelos = [MODELO_PRINCIPAL]
+    if MODELO_FALLBACK and MODELO_FALLBACK != MODELO_PRINCIPAL:
+        modelos.append(MODELO_FALLBACK)
+
+    ultimo_error = None
+    for modelo in modelos:
+        if fin - time.monotonic() <= 0:
+            break
+        circuito = _circuitos[modelo]
+        if not circuito.permite():
+            _registrar(modelo, 'circuito_abierto')
+            logger.warning("⚠️ Circuito abierto para %s, probando el siguiente modelo.", modelo)
+            continue
+        try:
+            response = _llamar_modelo(modelo, messages, max_tokens, temperature, fin)
+        except Exception as e:
+            if not _es_fallo_del_proveedor(e):
+                # El proveedor respondió: el circuito sigue sano y otro modelo fallaría igual
+                circuito.exito()
+                _registrar(modelo, 'error_cliente')
+                raise
+            circuito.fallo()
+            _registrar(modelo, 'timeout' if _es_timeout(e) else 'error')
+            logger.error("❌ Error llamando a %s: %s", modelo, e)
+            ultimo_error = e
+            continue
+        circuito.exito()
+        if modelo != MODELO_PRINCIPAL:
+            _registrar(modelo, 'fallback')
+        return response.choices[0].message.content
+
+    raise ultimo_error or RuntimeError("Ningún modelo disponible: circuitos abiertos o deadline agotado")
+
+
+def obtener_metricas():
+    """ Resultados por modelo, estado del circuito y latencia p95 observada. """
+    with _lock:
+        resultados = {modelo: dict(contadores) for modelo, contadores in _resultados.items()}
+
+    metricas = {}
+    for modelo, contadores in resultados.items():
+        p95 = _p95(modelo)
+        metricas[modelo] = {
+            **contadores,
+            'circuito': _circuitos[modelo].estado,
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+        }
+    return metricas
@@ -0,0 +1,101 @@
+# myapp/services/perfil_service.py
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+
+CAMPOS_REQUERIDOS = ['nombre', 'email', 'motivo_visita']
+MAX_PERFILES_EN_CACHE = 1024
+MAX_REINTENTOS = 3
+
+_perfiles = OrderedDict()
+_lock = threading.Lock()
+
+
+def asegurar_indices(usuarios_collection):
+    """ Crea el índice único por user_id que protege los upserts concurrentes. """
+    usuarios_collection.create_index('user_id', unique=True)
+
+
+def perfil_completo(perfil):
+    """ Indica si el perfil tiene los campos necesarios para considerarse un lead. """
+    return all(perfil.get(campo) for campo in CAMPOS_REQUERIDOS)
+
+
+def _cachear(user_id, perfil):
+    with _lock:
+        _perfiles[user_id] = perfil
+        _perfiles.move_to_end(user_id)
+        while len(_perfiles) > MAX_PERFILES_EN_CACHE:
+            _perfiles.popitem(last=False)
+
+
+def invalidar_perfil(user_id):
+    with _lock:
+        _perfiles.pop(user_id, None)
+
+
+def obtener_perfil(user_id, usuarios_collection):
+    """
+    Devuelve una copia del perfil del usuario, o None si no existe.
+    Se lee de la caché del proceso y solo se consulta MongoDB si no está cacheado.
+    """
+    with _lock:
+        perfil = _perfiles.get(user_id)
+    if perfil is None:
+        perfil = usuarios_collection.find_one({'user_id': user_id}, {'_id': 0})
+        if perfil is None:
+            return None
+        _cachear(user_id, perfil)
+    return dict(perfil)
+
+
+def guardar_perfil(user_id, cambios, usuarios_collection, logger, contexto=None):
+    """
+    Fusiona 'cambios' en el perfil del usuario y lo guarda en una sola escritura.
+    Usa un campo 'version' como bloqueo optimista: si otra pestaña guardó antes,
+    se recarga el perfil desde MongoDB y se vuelven a aplicar los cambios, así
+    no se pierden campos. 'contexto' (el chatbot donde se captó el lead) solo se
+    guarda si el perfil aún no tiene uno. Devuelve el perfil resultante (write-through).
+    """
+    for intento in range(MAX_REINTENTOS):
+        perfil = obtener_perfil(user_id, usuarios_collection) or {'user_id': user_id, 'version': 0}
+        version = perfil.get('version') or 0
+
+        perfil.update(cambios)
+        if contexto and not perfil.get('contexto'):
+            perfil['contexto'] = contexto
+        if perfil_completo(perfil) and 'fecha_registro' not in cambios:
+            perfil['fecha_registro'] = perfil.get('fecha_registro') or datetime.utcnow()
+        perfil['version'] = version + 1
+        perfil['actualizado'] = datetime.utcnow()
+
+        # Los documentos anteriores a este servicio no tienen 'version'
+        filtro = {'user_id': user_id, 'version': {'$in': [0, None]} if version == 0 else version}
+        try:
+            resultado = usuarios_collection.update_one(filtro, {'$set': perfil}, upsert=(version == 0))
+        except DuplicateKeyError:
+            resultado = None
+
+        if resultado is not None and (resultado.matched_count or resultado.upserted_id is not None):
+            _cachear(user_id, perfil)
+            return dict(perfil)
+
+        logger.info("♻️ Conflicto de versión en el perfil %s (intento %d), recargando.", user_id, intento + 1)
+        invalidar_perfil(user_id)
+
+    raise RuntimeError(f"No se pudo guardar el perfil de {user_id} tras {MAX_REINTENTOS} intentos")
+
+
+def fijar_campos(user_id, campos, usuarios_collection):
+    """
+    Escribe 'campos' de forma atómica sin comprobar la versión (solo $set de esos
+    campos, así que no pisa otros). Sube la versión para que las cachés de otros
+    procesos detecten el cambio. Se usa cuando perder el valor no es aceptable.
+    """
+    usuarios_collection.update_one(
+        {'user_id': user_id},
+        {'$set': {**campos, 'actualizado': datetime.utcnow()}, '$inc': {'version': 1}}
+    )
+    invalidar_perfil(user_id)
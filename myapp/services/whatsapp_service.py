@@ -0,0 +1,220 @@
+# myapp/services/whatsapp_service.py
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from pymongo.errors import DuplicateKeyError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+GRAPH_API_URL = "https://graph.facebook.com/v17.0"
+MAX_LONGITUD_TEXTO = 4096  # Límite de Meta para el cuerpo de un mensaje de texto
+MUESTRAS_LATENCIA = 1000
+
+# Ids (wamid) de mensajes entrantes ya procesados. Meta reintenta los webhooks
+# fallidos durante días, así que se guardan una semana (índice TTL).
+COLECCION_MENSAJES = "whatsapp_mensajes"
+RETENCION_MENSAJES = 7 * 24 * 3600
+
+
+def asegurar_indices(db):
+    """ El _id (wamid) ya es único; el índice TTL purga los ids antiguos. """
+    db[COLECCION_MENSAJES].create_index("recibido", expireAfterSeconds=RETENCION_MENSAJES)
+
+
+def reclamar_mensaje(db, wamid):
+    """
+    Registra el mensaje entrante en MongoDB. Devuelve False si ya lo había
+    registrado otra entrega (en este u otro worker), es decir, si es un reenvío.
+    """
+    try:
+        db[COLECCION_MENSAJES].insert_one({"_id": wamid, "recibido": datetime.utcnow()})
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def dividir_mensaje(texto, limite=MAX_LONGITUD_TEXTO):
+    """
+    Divide una respuesta larga en trozos de como máximo 'limite' caracteres,
+    cortando preferentemente en párrafos, líneas, frases o espacios.
+    """
+    partes = []
+    while len(texto) > limite:
+        corte = -1
+        for separador in ("\n\n", "\n", ". ", " "):
+            corte = texto.rfind(separador, 0, limite)
+            if corte > 0:
+                corte += len(separador)
+                break
+        if corte <= 0:
+            corte = limite
+        partes.append(texto[:corte].rstrip())
+        texto = texto[corte:].lstrip()
+    if texto:
+        partes.append(texto)
+    return partes
+
+
+class TokenBucket:
+    """
+    Limitador de tasa simple: 'tasa' mensajes por segundo con ráfagas de hasta
+    max(1, tasa), así una tasa inferior a 1 (p. ej. 0.5) sigue pudiendo enviar.
+    """
+
+    def __init__(self, tasa):
+        self.tasa = float(tasa)
+        if not self.tasa > 0:
+            raise ValueError(f"La tasa de envío debe ser positiva (WHATSAPP_MPS={tasa!r})")
+        self.capacidad = max(1.0, self.tasa)
+        self.tokens = self.capacidad
+        self.ultimo = time.monotonic()
+        self.lock = threading.Lock()
+
+    def adquirir(self):
+        while True:
+            with self.lock:
+                ahora = time.monotonic()
+                self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+                self.ultimo = ahora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                espera = (1 - self.tokens) / self.tasa
+            time.sleep(espera)
+
+
+class WhatsAppSender:
+    """
+    Envía mensajes por la API de WhatsApp Cloud reutilizando conexiones.
+    - Pool HTTP persistente con timeouts estrictos.
+    - Limitación de tasa por número de teléfono emisor (tier de Meta, WHATSAPP_MPS).
+    - Reintentos con backoff solo ante 429 (respetando Retry-After) y errores de
+      conexión. Un 5xx o una respuesta perdida no se reintentan: Meta puede haber
+      entregado ya el mensaje y el usuario lo recibiría duplicado.
+    - División de respuestas largas en mensajes permitidos.
+    Los envíos nunca lanzan excepciones hacia el webhook; se registran en las métricas.
+    """
+
+    def __init__(self, access_token, phone_number_id, mensajes_por_segundo=80,
+                 timeout=(3.05, 10), max_reintentos=3, pool_size=10, max_workers=4):
+        self.access_token = access_token
+        self.phone_number_id = phone_number_id
+        self.timeout = timeout
+        self.limitador = TokenBucket(mensajes_por_segundo)
+
+        reintentos = Retry(
+            total=max_reintentos,
+            read=0,
+            backoff_factor=0.5,
+            status_forcelist=(429,),
+            allowed_methods=frozenset(["POST"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self.http = requests.Session()
+        self.http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=reintentos))
+        self.http.headers.update({"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"})
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="whatsapp-sender")
+        self._lock = threading.Lock()
+        self._latencias = deque(maxlen=MUESTRAS_LATENCIA)
+        self._contadores = {"enviados": 0, "fallidos": 0, "limitados": 0, "partes": 0, "reenvios_descartados": 0}
+
+    def _registrar(self, contador, latencia=None):
+        with self._lock:
+            self._contadores[contador] += 1
+            if latencia is not None:
+                self._latencias.append(latencia)
+
+    def registrar_reenvio_descartado(self):
+        """ Cuenta un webhook reenviado por Meta que no se volvió a responder. """
+        self._registrar("reenvios_descartados")
+
+    def _enviar_parte(self, phone, texto):
+        url = f"{GRAPH_API_URL}/{self.phone_number_id}/messages"
+        payload = {"messaging_product": "whatsapp", "to": phone, "text": {"body": texto}}
+
+        self.limitador.adquirir()
+        inicio = time.monotonic()
+        try:
+            response = self.http.post(url, json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            self._registrar("fallidos", time.monotonic() - inicio)
+            logger.error("❌ Error enviando WhatsApp a %s: %s", phone, e)
+            return False
+        latencia = time.monotonic() - inicio
+
+        if response.ok:
+            self._registrar("enviados", latencia)
+            return True
+
+        self._registrar("limitados" if response.status_code == 429 else "fallidos", latencia)
+        logger.error("❌ WhatsApp respondió %s para %s: %s", response.status_code, phone, response.text[:500])
+        return False
+
+    def enviar(self, phone, message):
+        """ Envía 'message' a 'phone' (dividiéndolo si hace falta). Devuelve True si todo se envió. """
+        partes = dividir_mensaje(message)
+        with self._lock:
+            self._contadores["partes"] += len(partes)
+        for parte in partes:
+            if not self._enviar_parte(phone, parte):
+                return False
+        logger.info("📤 Respuesta enviada a %s en %d mensaje(s)", phone, len(partes))
+        return True
+
+    def enviar_en_segundo_plano(self, phone, message):
+        """ Encola el envío para que el webhook pueda responder a Meta sin esperar. """
+        futuro = self.executor.submit(self.enviar, phone, message)
+        futuro.add_done_callback(lambda f: self._registrar_excepcion(f, phone))
+        return futuro
+
+    def _registrar_excepcion(self, futuro, phone):
+        """ Nadie espera el Future: cualquier excepción inesperada se registra aquí. """
+        error = futuro.exception()
+        if error is not None:
+            self._registrar("fallidos")
+            logger.error("❌ Error inesperado enviando WhatsApp a %s: %r", phone, error,
+                         exc_info=(type(error), error, error.__traceback__))
+
+    def metricas(self):
+        with self._lock:
+            latencias = sorted(self._latencias)
+            contadores = dict(self._contadores)
+
+        def percentil(p):
+            if not latencias:
+                return None
+            return round(latencias[min(len(latencias) - 1, int(p * len(latencias)))] * 1000, 1)
+
+        return {
+            **contadores,
+            "latencia_ms": {"p50": percentil(0.50), "p95": percentil(0.95), "p99": percentil(0.99)},
+        }
+
+
+_senders = {}
+_senders_lock = threading.Lock()
+
+
+def get_sender(phone_number_id=None):
+    """ Devuelve el sender compartido (y su limitador) para el número emisor indicado. """
+    phone_number_id = phone_number_id or os.getenv("PHONE_NUMBER_ID")
+    with _senders_lock:
+        sender = _senders.get(phone_number_id)
+        if sender is None:
+            sender = WhatsAppSender(
+                os.getenv("WHATSAPP_ACCESS_TOKEN"),
+                phone_number_id,
+                mensajes_por_segundo=float(os.getenv("WHATSAPP_MPS", "80")),
+            )
+            _senders[phone_number_id] = sender
+        return sender
@@ -0,0 +1,144 @@
+# myapp/services/woocomerce_service.py
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Lee las variables de entorno
+WC_SITE_URL = (os.getenv("WC_SITE_URL") or "").rstrip("/")
+WC_CONSUMER_KEY = os.getenv("WC_CONSUMER_KEY")
+WC_CONSUMER_SECRET = os.getenv("WC_CONSUMER_SECRET")
+
+WC_API_URL = f"{WC_SITE_URL}/wp-json/wc/v3"  # API REST (catálogo y pedidos)
+
+TTL_CATALOGO = float(os.getenv("WC_CATALOG_TTL", "300"))
+REINTENTO_CATALOGO = 30  # Segundos hasta reintentar tras un error de la tienda
+
+
+class WooCommerceClient:
+    """
+    Cliente de la API REST de WooCommerce con un pool de conexiones compartido y
+    timeouts estrictos. El catálogo se cachea TTL_CATALOGO segundos: al caducar
+    se sigue sirviendo la copia anterior mientras un único hilo la recarga, y
+    si la tienda falla se mantiene la copia anterior.
+    """
+
+    def __init__(self, timeout=(3.05, 8), pool_size=10):
+        self.timeout = timeout
+        reintentos = Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+                           allowed_methods=frozenset(["GET"]))
+        self.http = requests.Session()
+        self.http.mount("https://", HTTPAdapter(pool_maxsize=pool_size, max_retries=reintentos))
+        self.http.mount("http://", HTTPAdapter(pool_maxsize=pool_size, max_retries=reintentos))
+
+        self._catalogo = (0, None)  # (expira, productos)
+        self._lock_catalogo = threading.Lock()
+
+    def _api_request(self, metodo, ruta, **kwargs):
+        response = self.http.request(
+            metodo, f"{WC_API_URL}{ruta}",
+            auth=(WC_CONSUMER_KEY, WC_CONSUMER_SECRET),
+            timeout=self.timeout, **kwargs
+        )
+        response.raise_for_status()
+        return response
+
+    def _refrescar_catalogo(self):
+        """ Descarga el catálogo completo (paginando de 100 en 100). Llamar con _lock_catalogo tomado. """
+        try:
+            productos, pagina = [], 1
+            while True:
+                response = self._api_request("GET", "/products",
+                                             params={"per_page": 100, "page": pagina, "status": "publish"})
+                productos.extend(response.json())
+                if pagina >= int(response.headers.get("X-WP-TotalPages", 1)):
+                    break
+                pagina += 1
+        except (requests.RequestException, ValueError) as e:
+            # ValueError: la tienda respondió 200 con algo que no es JSON (p. ej. una página de error)
+            _, anteriores = self._catalogo
+            logger.error("❌ Error recargando el catálogo de WooCommerce (se mantiene la copia anterior): %s", e)
+            self._catalogo = (time.monotonic() + REINTENTO_CATALOGO, anteriores)
+            return
+
+        self._catalogo = (time.monotonic() + TTL_CATALOGO, productos)
+        logger.debug("📦 Catálogo de WooCommerce recargado: %d productos", len(productos))
+
+    def _refrescar_y_liberar(self):
+        try:
+            self._refrescar_catalogo()
+        finally:
+            self._lock_catalogo.release()
+
+    def obtener_productos(self):
+        """
+        Lista los productos publicados. Solo la primera carga bloquea la petición;
+        después los turnos nunca esperan a la tienda (la recarga va en segundo plano).
+        Si la primera carga falla se devuelve un catálogo vacío sin volver a llamar
+        a la tienda hasta pasados REINTENTO_CATALOGO segundos.
+        """
+        expira, productos = self._catalogo
+        if productos is not None:
+            if expira <= time.monotonic() and self._lock_catalogo.acquire(blocking=False):
+                threading.Thread(target=self._refrescar_y_liberar, name="wc-catalogo", daemon=True).start()
+            return productos
+        if expira > time.monotonic():
+            return []
+
+        with self._lock_catalogo:
+            expira, productos = self._catalogo
+            if productos is None and expira <= time.monotonic():
+                self._refrescar_catalogo()
+        return self._catalogo[1] or []
+
+    def create_order_for_checkout(self, line_items, datos_cliente=None):
+        """
+        Crea un pedido pendiente de pago.
+        line_items: [{"product_id": 101, "quantity": 2}, ...]
+        """
+        pedido = {"status": "pending", "set_paid": False, "line_items": line_items}
+        if datos_cliente:
+            pedido["billing"] = datos_cliente
+        return self._api_request("POST", "/orders", json=pedido).json()
+
+
+_cliente = WooCommerceClient()
+
+
+def obtener_productos():
+    return _cliente.obtener_productos()
+
+
+def obtener_productos_con_categorias():
+    """
+    Devuelve {nombre del producto en minúsculas: (id, slug de la categoría)}.
+    Usa el catálogo cacheado, así detectar un producto no cuesta una petición por turno.
+    """
+    productos = {}
+    for producto in _cliente.obtener_productos():
+        categorias = producto.get("categories") or [{}]
+        productos[producto["name"].lower()] = (producto["id"], categorias[0].get("slug"))
+    return productos
+
+
+def get_add_to_cart_url(product_id, categoria=None, cantidad=1):
+    """ URL que añade el producto al carrito del navegador del usuario (sin petición desde el servidor). """
+    base = f"{WC_SITE_URL}/product-category/{categoria}/" if categoria else f"{WC_SITE_URL}/"
+    return f"{base}?add-to-cart={product_id}&quantity={cantidad}"
+
+
+def create_order_for_checkout(line_items, datos_cliente=None):
+    return _cliente.create_order_for_checkout(line_items, datos_cliente)
+
+
+def get_checkout_url(pedido=None):
+    """ URL de pago del pedido creado o, si no hay pedido, la página de checkout de la tienda. """
+    if pedido and pedido.get("payment_url"):
+        return pedido["payment_url"]
+    return f"{WC_SITE_URL}/checkout/"
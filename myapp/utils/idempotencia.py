@@ -0,0 +1,104 @@
+# myapp/utils/idempotencia.py
+import hashlib
+import os
+import threading
+import time
+
+TTL_RESULTADOS = float(os.getenv('IDEMPOTENCY_TTL', '60'))
+ESPERA_MAXIMA = float(os.getenv('IDEMPOTENCY_WAIT', '60'))
+MAX_RESULTADOS = 10000
+
+
+class ConflictoIdempotencia(Exception):
+    """ La misma clave de idempotencia se reutilizó con una petición distinta. """
+
+
+class _Llamada:
+    def __init__(self, huella):
+        self.huella = huella
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce peticiones idénticas:
+    - Si ya hay una en curso con la misma clave, se espera su resultado (single-flight).
+    - Los resultados recientes se reproducen durante 'ttl' segundos sin recalcular.
+    El almacén es de cada proceso: con varios workers de gunicorn, un reintento
+    que llega a otro worker se vuelve a calcular.
+    """
+
+    def __init__(self, ttl=TTL_RESULTADOS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._en_curso = {}
+        self._resultados = {}  # clave -> (expira, resultado, huella)
+        self._contadores = {'calculados': 0, 'compartidos': 0, 'reproducidos': 0}
+
+    def _guardar(self, clave, resultado, huella):
+        ahora = time.monotonic()
+        if len(self._resultados) >= MAX_RESULTADOS:
+            self._resultados = {k: v for k, v in self._resultados.items() if v[0] > ahora}
+        self._resultados[clave] = (ahora + self.ttl, resultado, huella)
+
+    def ejecutar(self, clave, funcion, cacheable=lambda resultado: True, huella=None):
+        """
+        Ejecuta 'funcion' una sola vez por clave.
+        Devuelve (resultado, deduplicado); deduplicado es True si no se recalculó.
+        'huella' identifica el contenido de la petición: si la clave ya se usó con
+        otra huella se lanza ConflictoIdempotencia en lugar de devolver otra respuesta.
+        """
+        with self._lock:
+            expira, resultado, huella_guardada = self._resultados.get(clave, (0, None, None))
+            if expira > time.monotonic():
+                if huella_guardada != huella:
+                    raise ConflictoIdempotencia(clave)
+                self._contadores['reproducidos'] += 1
+                return resultado, True
+
+            llamada = self._en_curso.get(clave)
+            if llamada is not None and llamada.huella != huella:
+                raise ConflictoIdempotencia(clave)
+            lider = llamada is None
+            if lider:
+                llamada = self._en_curso[clave] = _Llamada(huella)
+                self._contadores['calculados'] += 1
+            else:
+                self._contadores['compartidos'] += 1
+
+        if not lider:
+            if llamada.evento.wait(ESPERA_MAXIMA):
+                if llamada.error is not None:
+                    raise llamada.error
+                return llamada.resultado, True
+            # El líder no terminó a tiempo: se calcula sin coalescer
+            return funcion(), False
+
+        try:
+            llamada.resultado = funcion()
+            return llamada.resultado, False
+        except Exception as e:
+            llamada.error = e
+            raise
+        finally:
+            with self._lock:
+                self._en_curso.pop(clave, None)
+                if llamada.error is None and cacheable(llamada.resultado):
+                    self._guardar(clave, llamada.resultado, huella)
+            llamada.evento.set()
+
+    def metricas(self):
+        with self._lock:
+            contadores = dict(self._contadores)
+        contadores['deduplicados'] = contadores['compartidos'] + contadores['reproducidos']
+        return contadores
+
+
+def clave_automatica(*partes):
+    """ Hash estable de las partes que identifican una petición (p. ej. sesión, mensaje, turno). """
+    return hashlib.sha256("\x1f".join(str(parte) for parte in partes).encode("utf-8")).hexdigest()
+
+
+coalescedor = SingleFlight()
@@ -0,0 +1,103 @@
+# myapp/utils/log_utils.py
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+CAMPOS_ESTANDAR = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """ Serializa cada registro como una línea JSON (se ejecuta en el hilo del listener). """
+
+    def format(self, record):
+        entrada = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', None),
+            'message': record.getMessage(),
+        }
+        # Campos estructurados pasados con extra={...}
+        for campo, valor in vars(record).items():
+            if campo not in CAMPOS_ESTANDAR and campo not in entrada:
+                entrada[campo] = valor
+        if record.exc_info:
+            entrada['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entrada, ensure_ascii=False, default=str)
+
+
+class MuestreoDebugFilter(logging.Filter):
+    """ Deja pasar solo una fracción de los eventos DEBUG; el resto se descarta sin formatear. """
+
+    def __init__(self, tasa):
+        super().__init__()
+        self.tasa = tasa
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.tasa
+
+
+class RequestIdFilter(logging.Filter):
+    """ Añade el request_id de la petición en curso al registro. """
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = getattr(g, 'request_id', None)
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler que no formatea en el hilo de la petición: solo congela el
+    mensaje (args -> str) para que los objetos mutables no cambien antes de
+    que el listener lo procese.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def init_logging(app):
+    """
+    Sustituye los handlers de app.logger por un QueueHandler: el formateo JSON
+    y la escritura a stdout ocurren en un hilo aparte (QueueListener).
+    """
+    nivel = app.config.get('LOG_LEVEL', 'INFO')
+    tasa_debug = float(app.config.get('LOG_DEBUG_SAMPLE_RATE', 0.01))
+
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(JsonFormatter())
+
+    cola = queue.SimpleQueue()
+    handler = LazyQueueHandler(cola)
+    handler.addFilter(MuestreoDebugFilter(tasa_debug))
+    handler.addFilter(RequestIdFilter())
+
+    listener = QueueListener(cola, salida, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # app.logger ('myapp') es el padre de los loggers de módulo 'myapp.*'
+    app.logger.handlers.clear()
+    app.logger.addHandler(handler)
+    app.logger.setLevel(nivel)
+    app.logger.propagate = False
+
+    @app.before_request
+    def asignar_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+    @app.after_request
+    def devolver_request_id(response):
+        response.headers['X-Request-ID'] = g.get('request_id', '')
+        return response
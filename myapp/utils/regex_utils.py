@@ -1,7 +1,10 @@
 import re
 import difflib
+import logging
 from myapp.services.woocomerce_service import obtener_productos, obtener_productos_con_categorias
 
+logger = logging.getLogger(__name__)
+
 
 regex_patterns = {
     'nombre': re.compile(r'(?i)(?:mi nombre es|soy|me llamo|mi nombre)\s+([A-ZÁÉÍÓÚÜÑa-záéíóúüñ]+(?:\s+[A-ZÁÉÍÓÚÜÑa-záéíóúüñ]+)*)'),
@@ -28,7 +31,7 @@ def detectar_producto_y_cantidad(mensaje):
     productos_disponibles = obtener_productos_con_categorias()
 
     # 📌 Debug: Mostrar qué productos está obteniendo WooCommerce
-    print(f"🔍 Productos obtenidos: {productos_disponibles.keys()}")
+    logger.debug("🔍 Productos obtenidos: %s", productos_disponibles.keys())
 
     # 🔍 Detectar intención
     intencion_match = regex_patterns["intencion"].search(mensaje)
@@ -60,7 +63,8 @@ def detectar_producto_y_cantidad(mensaje):
         cantidad = int(cantidad_match.group(1))  # Extraer solo el número
 
     # 🛠️ Log para depuración final
-    print(f"✅ Producto detectado: {producto_detectado} (ID: {producto_id}, Categoría: {categoria}), Cantidad: {cantidad}")
+    logger.debug("✅ Producto detectado: %s (ID: %s, Categoría: %s), Cantidad: %s",
+                 producto_detectado, producto_id, categoria, cantidad)
 
     return {
         "intencion": intencion,
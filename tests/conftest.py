@@ -0,0 +1,4 @@
+import os
+
+# El cliente de OpenAI se crea al importar la app y exige una API key
+os.environ.setdefault("OPEN_API_KEY", "test-key")
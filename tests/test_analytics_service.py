@@ -0,0 +1,121 @@
+import logging
+from datetime import datetime
+from types import SimpleNamespace
+
+from myapp.services import analytics_service
+from myapp.services.analytics_service import (ROLLUP_CONVERSACIONES, ROLLUP_LEADS, _dias_afectados,
+                                              _filtro_dias, _pipeline_conversaciones, _rango_turnos,
+                                              refrescar_rollups)
+
+logger = logging.getLogger(__name__)
+
+
+class _Coleccion:
+    """ Registra las operaciones; aggregate devuelve los días indicados para el $group de días. """
+
+    def __init__(self, nombre, operaciones, dias=()):
+        self.nombre = nombre
+        self.operaciones = operaciones
+        self.dias = list(dias)
+        self.estado = None
+
+    def aggregate(self, pipeline):
+        self.operaciones.append((self.nombre, 'aggregate', pipeline))
+        if '$merge' in pipeline[-1]:
+            return iter(())
+        return iter({'_id': dia} for dia in self.dias)
+
+    def delete_many(self, filtro):
+        self.operaciones.append((self.nombre, 'delete_many', filtro))
+
+    def update_many(self, filtro, cambios):
+        self.operaciones.append((self.nombre, 'update_many', filtro))
+        return SimpleNamespace(modified_count=0)
+
+    def find_one(self, filtro):
+        return self.estado
+
+    def update_one(self, filtro, cambios, upsert=False):
+        self.operaciones.append((self.nombre, 'update_one', cambios))
+
+
+class _Db(dict):
+    def __init__(self, dias_usuarios=(), dias_chats=(), hasta=None):
+        super().__init__()
+        self.operaciones = []
+        for nombre in (ROLLUP_LEADS, ROLLUP_CONVERSACIONES, analytics_service.ESTADO):
+            self[nombre] = _Coleccion(nombre, self.operaciones)
+        self[analytics_service.ESTADO].estado = {'_id': 'rollups', 'hasta': hasta} if hasta else None
+        self.usuarios = _Coleccion('usuarios', self.operaciones, dias_usuarios)
+        self.chats = _Coleccion('chats', self.operaciones, dias_chats)
+
+
+def _evaluar_rango(turnos):
+    """ Evalúa en Python el $switch de _rango_turnos. """
+    switch = _rango_turnos()['$switch']
+    for rama in switch['branches']:
+        if turnos <= rama['case']['$lte'][1]:
+            return rama['then']
+    return switch['default']
+
+
+def test_dias_afectados_sin_marca_recorre_todo():
+    coleccion = _Coleccion('chats', [], dias=['2024-05-02', '2024-05-01'])
+
+    assert _dias_afectados(coleccion, 'creado', None) == ['2024-05-01', '2024-05-02']
+    filtro = coleccion.operaciones[0][2][0]['$match']
+    assert filtro == {'creado': {'$type': 'date'}}
+
+
+def test_dias_afectados_con_marca_solo_lo_modificado():
+    coleccion = _Coleccion('usuarios', [], dias=['2024-05-01'])
+    desde = datetime(2024, 5, 3, 12)
+
+    _dias_afectados(coleccion, 'fecha_registro', desde)
+    filtro = coleccion.operaciones[0][2][0]['$match']
+    assert filtro == {'fecha_registro': {'$type': 'date'}, 'actualizado': {'$gte': desde}}
+
+
+def test_filtro_dias_cubre_cada_dia_completo():
+    assert _filtro_dias('creado', ['2024-05-01', '2024-05-31']) == {'$or': [
+        {'creado': {'$gte': datetime(2024, 5, 1), '$lt': datetime(2024, 5, 2)}},
+        {'creado': {'$gte': datetime(2024, 5, 31), '$lt': datetime(2024, 6, 1)}},
+    ]}
+
+
+def test_rangos_de_la_distribucion_de_turnos():
+    assert [_evaluar_rango(t) for t in (0, 1, 2, 3, 5, 6, 10, 11, 20, 21, 300)] == \
+        ['0', '1-2', '1-2', '3-5', '3-5', '6-10', '6-10', '11-20', '11-20', '21+', '21+']
+
+
+def test_distribucion_turnos_es_un_objeto_rango_conversaciones():
+    pipeline = _pipeline_conversaciones(['2024-05-01'], datetime(2024, 5, 2))
+
+    por_dia = pipeline[3]['$group']
+    assert por_dia['distribucion_turnos'] == {'$push': {'k': '$_id.rango', 'v': '$conversaciones'}}
+    assert pipeline[4]['$set']['distribucion_turnos'] == {'$arrayToObject': '$distribucion_turnos'}
+    assert pipeline[-1]['$merge']['into'] == ROLLUP_CONVERSACIONES
+
+
+def test_refresco_borra_y_recalcula_solo_los_dias_afectados():
+    desde = datetime(2024, 5, 1)
+    db = _Db(dias_usuarios=['2024-05-01'], dias_chats=['2024-04-30', '2024-05-01'], hasta=desde)
+
+    resultado = refrescar_rollups(db, logger)
+
+    assert resultado == {'dias_leads': ['2024-05-01'], 'dias_conversaciones': ['2024-04-30', '2024-05-01']}
+    operaciones = [(nombre, operacion) for nombre, operacion, _ in db.operaciones]
+    assert operaciones == [
+        ('chats', 'update_many'),  # Completa 'creado' en chats antiguos
+        ('usuarios', 'aggregate'), (ROLLUP_LEADS, 'delete_many'), ('usuarios', 'aggregate'),
+        ('chats', 'aggregate'), (ROLLUP_CONVERSACIONES, 'delete_many'), ('chats', 'aggregate'),
+        (analytics_service.ESTADO, 'update_one'),
+    ]
+    assert db.operaciones[5][2] == {'dia': {'$in': ['2024-04-30', '2024-05-01']}}
+    assert db.operaciones[-1][2]['$set']['hasta'] > desde
+
+
+def test_refresco_sin_cambios_solo_avanza_la_marca():
+    db = _Db(hasta=datetime(2024, 5, 1))
+    assert refrescar_rollups(db, logger) == {'dias_leads': [], 'dias_conversaciones': []}
+    assert [operacion for _, operacion, _ in db.operaciones] == ['update_many', 'aggregate', 'aggregate', 'update_one']
@@ -0,0 +1,174 @@
+import pytest
+from flask.sessions import SecureCookieSessionInterface
+
+import myapp
+from myapp.config import Config
+from myapp.routes import chat as chat_routes
+from myapp.utils.idempotencia import SingleFlight
+
+
+class _Chats:
+    """ Colección 'chats' falsa con las consultas que usan las rutas de /chat. """
+
+    def __init__(self):
+        self.documentos = []
+
+    def _buscar(self, filtro):
+        for documento in self.documentos:
+            if all(documento.get(campo) == valor for campo, valor in filtro.items()):
+                return documento
+        return None
+
+    def find_one(self, filtro, proyeccion=None):
+        documento = self._buscar(filtro)
+        if documento is None:
+            return None
+        resultado = dict(documento)
+        rango = (proyeccion or {}).get("history")
+        if isinstance(rango, dict):
+            inicio, cantidad = rango["$slice"]
+            resultado["history"] = documento.get("history", [])[inicio:inicio + cantidad]
+        return resultado
+
+    def aggregate(self, pipeline):
+        documento = self._buscar(pipeline[0]["$match"])
+        if documento is None:
+            return iter(())
+        return iter([{"mensajes": len(documento.get("history", [])),
+                      "intenciones_carrito": documento.get("intenciones_carrito", 0)}])
+
+    def update_one(self, filtro, cambios, upsert=False):
+        documento = self._buscar(filtro)
+        if documento is None:
+            documento = dict(filtro, **cambios.get("$setOnInsert", {}))
+            self.documentos.append(documento)
+        documento.update(cambios.get("$set", {}))
+        for campo, incremento in cambios.get("$inc", {}).items():
+            documento[campo] = documento.get(campo, 0) + incremento
+
+
+@pytest.fixture
+def chats():
+    return _Chats()
+
+
+@pytest.fixture
+def cliente(monkeypatch, tmp_path, chats):
+    monkeypatch.setattr(Config, "SECRET_KEY", "test")
+    monkeypatch.setattr(Config, "SESSION_FILE_DIR", str(tmp_path))
+    monkeypatch.setattr(Config, "SESSION_COOKIE_SECURE", False)  # El cliente de pruebas usa http
+
+    def init_db(app):
+        app.db = type("Db", (), {"chats": chats})()
+
+    monkeypatch.setattr(myapp, "init_db", init_db)
+    app = myapp.create_app()
+    # Flask-Session 0.4 usa app.session_cookie_name, que Flask 3 ya no tiene
+    app.session_interface = SecureCookieSessionInterface()
+    return app.test_client()
+
+
+def _sesion(cliente):
+    """ Abre la sesión y devuelve (user_id, session_id). """
+    cliente.get("/chat/history")
+    with cliente.session_transaction() as session:
+        return session["user_id"], session["session_id"]
+
+
+def _con_historial(cliente, chats, mensajes):
+    user_id, session_id = _sesion(cliente)
+    history = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}"} for i in range(mensajes)]
+    chats.documentos.append({"user_id": user_id, "session_id": session_id, "history": history})
+    return history
+
+
+def test_historial_completo(cliente, chats):
+    history = _con_historial(cliente, chats, 4)
+
+    response = cliente.get("/chat/history")
+    assert response.status_code == 200
+    assert response.get_json() == {"history": history, "total": 4, "since": 0, "next": 4}
+    assert response.headers["X-Total-Messages"] == "4"
+
+
+def test_since_y_limit_paginan_por_mensajes(cliente, chats):
+    history = _con_historial(cliente, chats, 6)
+
+    datos = cliente.get("/chat/history?since=2&limit=3").get_json()
+    assert (datos["history"], datos["next"]) == (history[2:5], 5)
+    datos = cliente.get("/chat/history?since=5").get_json()
+    assert (datos["history"], datos["next"]) == (history[5:], 6)
+    assert cliente.get("/chat/history?since=6").get_json()["history"] == []
+
+
+@pytest.mark.parametrize("query", ["since=-1", "limit=0", "limit=-3"])
+def test_parametros_invalidos(cliente, query):
+    assert cliente.get(f"/chat/history?{query}").status_code == 400
+
+
+def test_etag_debil_responde_304_hasta_que_hay_mensajes_nuevos(cliente, chats):
+    history = _con_historial(cliente, chats, 2)
+
+    etag = cliente.get("/chat/history").headers["ETag"]
+    assert etag.startswith('W/"')
+    _, session_id = _sesion(cliente)
+    assert session_id not in etag
+
+    response = cliente.get("/chat/history", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["X-Total-Messages"] == "2"
+
+    history.append({"role": "user", "content": "otro"})
+    assert cliente.get("/chat/history", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_cabeceras_expuestas_al_frontend(cliente, chats):
+    _con_historial(cliente, chats, 2)
+    response = cliente.get("/chat/history", headers={"Origin": "http://localhost:4200"})
+    expuestas = {h.strip().lower() for h in response.headers["Access-Control-Expose-Headers"].split(",")}
+    assert {"etag", "x-total-messages"} <= expuestas
+
+
+@pytest.fixture
+def respuestas(monkeypatch, chats):
+    """ Sustituye el turno real (OpenAI, MongoDB) y numera las respuestas r1, r2... """
+    monkeypatch.setattr(chat_routes, "coalescedor", SingleFlight(ttl=60))
+    calculadas = []
+
+    def responder_chat(user_message, context_filename, user_id, session_id):
+        calculadas.append(user_message)
+        respuesta = f"r{len(calculadas)}"
+        history = chat_routes.get_chat_history(user_id, session_id)
+        history += [{"role": "user", "content": user_message}, {"role": "assistant", "content": respuesta}]
+        chat_routes.guardar_historial(user_id, session_id, history, context_filename)
+        return {"response": respuesta}, 200
+
+    monkeypatch.setattr(chat_routes, "responder_chat", responder_chat)
+    return calculadas
+
+
+def _enviar(cliente, mensaje, **headers):
+    return cliente.post("/chat/chat", json={"message": mensaje}, headers={"x-contexto": "robota-context", **headers})
+
+
+def test_mensaje_repetido_a_proposito_no_se_descarta(cliente, respuestas):
+    primera, segunda = _enviar(cliente, "sí"), _enviar(cliente, "sí")
+
+    assert (primera.get_json()["response"], segunda.get_json()["response"]) == ("r1", "r2")
+    assert segunda.headers["Idempotent-Replayed"] == "false"
+    assert respuestas == ["sí", "sí"]
+
+
+def test_reintento_con_idempotency_key_reproduce_la_respuesta(cliente, respuestas):
+    primera = _enviar(cliente, "hola", **{"Idempotency-Key": "k1"})
+    reintento = _enviar(cliente, "hola", **{"Idempotency-Key": "k1"})
+
+    assert reintento.get_json() == primera.get_json() == {"response": "r1"}
+    assert reintento.headers["Idempotent-Replayed"] == "true"
+    assert respuestas == ["hola"]
+
+
+def test_idempotency_key_reutilizada_con_otro_mensaje(cliente, respuestas):
+    _enviar(cliente, "hola", **{"Idempotency-Key": "k1"})
+    assert _enviar(cliente, "adiós", **{"Idempotency-Key": "k1"}).status_code == 422
+    assert respuestas == ["hola"]
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from myapp.utils.idempotencia import ConflictoIdempotencia, SingleFlight, clave_automatica
+
+
+def test_peticiones_concurrentes_comparten_un_solo_calculo():
+    flight = SingleFlight(ttl=5)
+    llamadas = []
+    resultados = []
+
+    def calcular():
+        llamadas.append(1)
+        time.sleep(0.2)
+        return "respuesta"
+
+    hilos = [threading.Thread(target=lambda: resultados.append(flight.ejecutar("k", calcular)))
+             for _ in range(5)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len(llamadas) == 1
+    assert sorted(resultados) == [("respuesta", False)] + [("respuesta", True)] * 4
+    assert flight.metricas() == {"calculados": 1, "compartidos": 4, "reproducidos": 0, "deduplicados": 4}
+
+
+def test_resultado_reciente_se_reproduce_hasta_que_caduca():
+    flight = SingleFlight(ttl=0.1)
+    contador = iter(range(10))
+
+    assert flight.ejecutar("k", lambda: next(contador)) == (0, False)
+    assert flight.ejecutar("k", lambda: next(contador)) == (0, True)
+    time.sleep(0.15)
+    assert flight.ejecutar("k", lambda: next(contador)) == (1, False)
+
+
+def test_errores_y_resultados_no_cacheables_no_se_reproducen():
+    flight = SingleFlight(ttl=5)
+
+    def falla():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        flight.ejecutar("k", falla)
+    assert flight.ejecutar("k", lambda: ({"error": "x"}, 500), cacheable=lambda r: r[1] < 500)[1] is False
+    assert flight.ejecutar("k", lambda: ({"ok": 1}, 200), cacheable=lambda r: r[1] < 500) == (({"ok": 1}, 200), False)
+
+
+def test_misma_clave_con_otra_huella_es_un_conflicto():
+    flight = SingleFlight(ttl=5)
+    flight.ejecutar("k", lambda: "hola", huella=clave_automatica("ctx", "hola"))
+
+    assert flight.ejecutar("k", lambda: "otra", huella=clave_automatica("ctx", "hola")) == ("hola", True)
+    with pytest.raises(ConflictoIdempotencia):
+        flight.ejecutar("k", lambda: "otra", huella=clave_automatica("ctx", "adiós"))
@@ -0,0 +1,161 @@
+import time
+from collections import defaultdict, deque
+
+import httpx
+import openai
+import pytest
+
+from myapp.services import llm_service
+
+
+@pytest.fixture(autouse=True)
+def estado_limpio(monkeypatch):
+    monkeypatch.setattr(llm_service, "MODELO_PRINCIPAL", "principal")
+    monkeypatch.setattr(llm_service, "MODELO_FALLBACK", "respaldo")
+    monkeypatch.setattr(llm_service, "HEDGE_HABILITADO", False)
+    monkeypatch.setattr(llm_service, "_resultados", defaultdict(lambda: defaultdict(int)))
+    monkeypatch.setattr(llm_service, "_latencias", defaultdict(lambda: deque(maxlen=200)))
+    monkeypatch.setattr(llm_service, "_hedges", defaultdict(lambda: deque(maxlen=llm_service.VENTANA_HEDGE)))
+    monkeypatch.setattr(llm_service, "_circuitos", defaultdict(
+        lambda: llm_service.CircuitBreaker(llm_service.FALLOS_PARA_ABRIR, llm_service.ENFRIAMIENTO_SEGUNDOS)))
+
+
+def _respuesta(texto):
+    mensaje = type("Mensaje", (), {"content": texto})
+    opcion = type("Opcion", (), {"message": mensaje})
+    return type("Respuesta", (), {"choices": [opcion]})
+
+
+def _error_http(clase, status):
+    response = httpx.Response(status, request=httpx.Request("POST", "http://stub/v1/chat/completions"))
+    return clase("error", response=response, body=None)
+
+
+def test_error_de_cliente_no_abre_el_circuito_ni_usa_fallback(monkeypatch):
+    llamados = []
+
+    def invocar(modelo, *args):
+        llamados.append(modelo)
+        raise _error_http(openai.BadRequestError, 400)
+
+    monkeypatch.setattr(llm_service, "_invocar", invocar)
+    for _ in range(llm_service.FALLOS_PARA_ABRIR + 2):
+        with pytest.raises(openai.BadRequestError):
+            llm_service.generar_respuesta([], deadline=1)
+
+    assert set(llamados) == {"principal"}
+    assert llm_service._circuitos["principal"].estado == "cerrado"
+    assert llm_service.obtener_metricas()["principal"]["error_cliente"] == llm_service.FALLOS_PARA_ABRIR + 2
+
+
+def test_error_5xx_usa_el_modelo_de_respaldo(monkeypatch):
+    def invocar(modelo, *args):
+        if modelo == "principal":
+            raise _error_http(openai.InternalServerError, 503)
+        return _respuesta("hola")
+
+    monkeypatch.setattr(llm_service, "_invocar", invocar)
+    assert llm_service.generar_respuesta([], deadline=1) == "hola"
+    metricas = llm_service.obtener_metricas()
+    assert metricas["principal"]["error"] == 1
+    assert metricas["respaldo"]["fallback"] == 1
+
+
+def test_el_deadline_cubre_principal_y_respaldo(monkeypatch):
+    def invocar(modelo, messages, max_tokens, temperature, timeout):
+        time.sleep(timeout + 0.05)
+        return _respuesta("tarde")
+
+    monkeypatch.setattr(llm_service, "_invocar", invocar)
+    inicio = time.monotonic()
+    with pytest.raises(TimeoutError):
+        llm_service.generar_respuesta([], deadline=0.3)
+    assert time.monotonic() - inicio < 0.5
+
+    metricas = llm_service.obtener_metricas()
+    assert metricas["principal"]["timeout"] == 1
+    assert "error" not in metricas["principal"]
+
+
+def test_timeout_del_sdk_cuenta_como_timeout(monkeypatch):
+    def invocar(modelo, *args):
+        if modelo == "principal":
+            raise openai.APITimeoutError(httpx.Request("POST", "http://stub/v1/chat/completions"))
+        return _respuesta("hola")
+
+    monkeypatch.setattr(llm_service, "_invocar", invocar)
+    assert llm_service.generar_respuesta([], deadline=1) == "hola"
+    assert llm_service.obtener_metricas()["principal"]["timeout"] == 1
+
+
+def _invocar_lento_la_primera_vez(llamados, espera):
+    def invocar(modelo, *args):
+        llamados.append(modelo)
+        if len(llamados) == 1:
+            time.sleep(espera)
+            return _respuesta("lenta")
+        return _respuesta("rápida")
+    return invocar
+
+
+def test_hedge_gana_la_primera_respuesta_y_registra_la_latencia_original(monkeypatch):
+    monkeypatch.setattr(llm_service, "HEDGE_HABILITADO", True)
+    monkeypatch.setattr(llm_service, "HEDGE_DESPUES_DE", "0.05")
+    llamados = []
+    monkeypatch.setattr(llm_service, "_invocar", _invocar_lento_la_primera_vez(llamados, 0.3))
+
+    inicio = time.monotonic()
+    assert llm_service.generar_respuesta([], deadline=2) == "rápida"
+    assert time.monotonic() - inicio < 0.25
+    assert llamados == ["principal", "principal"]
+    assert llm_service.obtener_metricas()["principal"]["hedge"] == 1
+
+    time.sleep(0.4)  # La petición original termina en segundo plano
+    latencias = llm_service._latencias["principal"]
+    assert latencias and min(latencias) >= 0.25  # Nunca la del hedge
+
+
+def test_la_tasa_de_hedge_esta_limitada(monkeypatch):
+    monkeypatch.setattr(llm_service, "HEDGE_HABILITADO", True)
+    monkeypatch.setattr(llm_service, "HEDGE_DESPUES_DE", "0.01")
+    llamados = []
+    monkeypatch.setattr(llm_service, "_invocar", _invocar_lento_la_primera_vez(llamados, 0.05))
+    llm_service._hedges["principal"].extend([True] + [False] * 8)  # Ya un 11% de hedges
+
+    assert llm_service.generar_respuesta([], deadline=1) == "lenta"
+    assert llamados == ["principal"]
+    assert "hedge" not in llm_service.obtener_metricas()["principal"]
+
+
+def test_circuito_half_open_deja_pasar_una_prueba_y_se_cierra(monkeypatch):
+    llm_service._circuitos["principal"] = llm_service.CircuitBreaker(umbral=1, enfriamiento=0.1)
+    caido = [True]
+    llamados = []
+
+    def invocar(modelo, *args):
+        llamados.append(modelo)
+        if modelo == "principal" and caido[0]:
+            raise _error_http(openai.InternalServerError, 503)
+        return _respuesta(modelo)
+
+    monkeypatch.setattr(llm_service, "_invocar", invocar)
+    assert llm_service.generar_respuesta([], deadline=1) == "respaldo"
+    assert llm_service._circuitos["principal"].estado == "abierto"
+
+    # Circuito abierto: el principal no se llama
+    llamados.clear()
+    assert llm_service.generar_respuesta([], deadline=1) == "respaldo"
+    assert llamados == ["respaldo"]
+
+    # Pasado el enfriamiento una prueba fallida lo vuelve a abrir...
+    time.sleep(0.15)
+    llamados.clear()
+    assert llm_service.generar_respuesta([], deadline=1) == "respaldo"
+    assert llamados == ["principal", "respaldo"]
+    assert llm_service._circuitos["principal"].estado == "abierto"
+
+    # ...y una prueba con éxito lo cierra
+    time.sleep(0.15)
+    caido[0] = False
+    assert llm_service.generar_respuesta([], deadline=1) == "principal"
+    assert llm_service._circuitos["principal"].estado == "cerrado"
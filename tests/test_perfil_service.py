@@ -0,0 +1,149 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from myapp.services import perfil_service
+from myapp.utils.data_utils import manejar_datos_usuario
+
+logger = logging.getLogger(__name__)
+
+
+class _Usuarios:
+    """ Colección falsa con la semántica de update_one que usa perfil_service. """
+
+    def __init__(self, *documentos):
+        self.documentos = [dict(d) for d in documentos]
+        self.antes_de_escribir = None  # Simula otra escritura concurrente
+        self.escrituras = 0
+
+    def _coincide(self, documento, filtro):
+        for campo, valor in filtro.items():
+            if isinstance(valor, dict) and '$in' in valor:
+                if documento.get(campo) not in valor['$in']:
+                    return False
+            elif documento.get(campo) != valor:
+                return False
+        return True
+
+    def find_one(self, filtro, proyeccion=None):
+        for documento in self.documentos:
+            if self._coincide(documento, filtro):
+                return dict(documento)
+        return None
+
+    def update_one(self, filtro, cambios, upsert=False):
+        self.escrituras += 1
+        if self.antes_de_escribir:
+            self.antes_de_escribir(self)
+        for documento in self.documentos:
+            if self._coincide(documento, filtro):
+                documento.update(cambios.get('$set', {}))
+                for campo, incremento in cambios.get('$inc', {}).items():
+                    documento[campo] = (documento.get(campo) or 0) + incremento
+                return SimpleNamespace(matched_count=1, upserted_id=None)
+        if not upsert:
+            return SimpleNamespace(matched_count=0, upserted_id=None)
+        if self.find_one({'user_id': filtro['user_id']}):  # Índice único por user_id
+            raise DuplicateKeyError("user_id duplicado")
+        self.documentos.append(dict(cambios['$set']))
+        return SimpleNamespace(matched_count=0, upserted_id=len(self.documentos))
+
+
+@pytest.fixture(autouse=True)
+def cache_vacia():
+    perfil_service._perfiles.clear()
+    yield
+    perfil_service._perfiles.clear()
+
+
+def test_primer_guardado_crea_el_perfil():
+    usuarios = _Usuarios()
+    perfil = perfil_service.guardar_perfil('u1', {'nombre': 'Ana'}, usuarios, logger, contexto='robota')
+
+    assert perfil['version'] == 1
+    assert perfil['contexto'] == 'robota'
+    assert usuarios.find_one({'user_id': 'u1'})['nombre'] == 'Ana'
+
+
+def test_documento_antiguo_sin_version():
+    usuarios = _Usuarios({'user_id': 'u1', 'nombre': 'Ana', 'contexto': 'original'})
+    perfil = perfil_service.guardar_perfil('u1', {'email': 'ana@x.com'}, usuarios, logger, contexto='otro')
+
+    assert perfil['version'] == 1
+    assert perfil['contexto'] == 'original'
+    assert usuarios.find_one({'user_id': 'u1'})['email'] == 'ana@x.com'
+
+
+def test_conflicto_de_version_recarga_y_conserva_ambos_cambios():
+    usuarios = _Usuarios({'user_id': 'u1', 'nombre': 'Ana', 'version': 1})
+    perfil_service.obtener_perfil('u1', usuarios)  # Queda en caché la versión 1
+    # Otra pestaña (u otro proceso) guarda el email mientras tanto
+    usuarios.documentos[0].update({'email': 'ana@x.com', 'version': 2})
+
+    perfil = perfil_service.guardar_perfil('u1', {'motivo_visita': 'robots'}, usuarios, logger)
+
+    assert usuarios.escrituras == 2
+    assert perfil['version'] == 3
+    assert (perfil['nombre'], perfil['email'], perfil['motivo_visita']) == ('Ana', 'ana@x.com', 'robots')
+    assert perfil['fecha_registro'] is not None
+    assert usuarios.find_one({'user_id': 'u1'}) == perfil
+
+
+def test_dos_primeros_guardados_a_la_vez():
+    usuarios = _Usuarios()
+
+    def inserta_otro(coleccion):
+        coleccion.antes_de_escribir = None
+        coleccion.documentos.append({'user_id': 'u1', 'email': 'ana@x.com', 'version': 1})
+
+    usuarios.antes_de_escribir = inserta_otro
+    perfil = perfil_service.guardar_perfil('u1', {'nombre': 'Ana'}, usuarios, logger)
+
+    assert len(usuarios.documentos) == 1
+    assert (perfil['nombre'], perfil['email'], perfil['version']) == ('Ana', 'ana@x.com', 2)
+
+
+def test_sin_reintentos_lanza_runtime_error():
+    usuarios = _Usuarios({'user_id': 'u1', 'version': 1})
+
+    def sube_version(coleccion):
+        coleccion.documentos[0]['version'] += 1
+
+    usuarios.antes_de_escribir = sube_version
+    with pytest.raises(RuntimeError):
+        perfil_service.guardar_perfil('u1', {'nombre': 'Ana'}, usuarios, logger)
+    assert usuarios.escrituras == perfil_service.MAX_REINTENTOS
+    assert 'nombre' not in usuarios.documentos[0]
+
+
+def test_fijar_campos_sube_version_e_invalida_la_cache():
+    usuarios = _Usuarios({'user_id': 'u1', 'nombre': 'Ana', 'version': 1})
+    perfil_service.obtener_perfil('u1', usuarios)
+
+    perfil_service.fijar_campos('u1', {'deal_id': 7}, usuarios)
+
+    perfil = perfil_service.obtener_perfil('u1', usuarios)
+    assert (perfil['deal_id'], perfil['nombre'], perfil['version']) == (7, 'Ana', 2)
+
+
+class _Sesion(dict):
+    modified = False
+
+
+def test_datos_de_sesion_solo_se_migran_si_se_guarda_el_perfil():
+    session = _Sesion(datos_acumulados={'nombre': 'Ana'})
+    usuarios = _Usuarios()
+
+    def mongo_caido(coleccion):
+        raise RuntimeError("Mongo caído")
+
+    usuarios.antes_de_escribir = mongo_caido
+    assert manejar_datos_usuario('u1', {'email': 'ana@x.com'}, session, usuarios, logger) is None
+    assert session['datos_acumulados'] == {'nombre': 'Ana'}
+
+    usuarios.antes_de_escribir = None
+    perfil = manejar_datos_usuario('u1', {'email': 'ana@x.com'}, session, usuarios, logger)
+    assert (perfil['nombre'], perfil['email']) == ('Ana', 'ana@x.com')
+    assert 'datos_acumulados' not in session and session.modified
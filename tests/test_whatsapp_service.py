@@ -0,0 +1,93 @@
+import hashlib
+import hmac
+import time
+
+import pytest
+
+from myapp.routes import whatsapp
+from myapp.services.whatsapp_service import MAX_LONGITUD_TEXTO, TokenBucket, WhatsAppSender, dividir_mensaje
+
+
+def test_dividir_mensaje_corto_no_se_divide():
+    assert dividir_mensaje("hola") == ["hola"]
+    assert dividir_mensaje("") == []
+
+
+def test_dividir_mensaje_respeta_el_limite_y_corta_en_parrafos():
+    texto = "a" * 30 + "\n\n" + "b" * 30
+    assert dividir_mensaje(texto, limite=40) == ["a" * 30, "b" * 30]
+
+
+def test_dividir_mensaje_sin_separadores_corta_en_el_limite():
+    partes = dividir_mensaje("x" * (MAX_LONGITUD_TEXTO * 2 + 10))
+    assert [len(p) for p in partes] == [MAX_LONGITUD_TEXTO, MAX_LONGITUD_TEXTO, 10]
+
+
+def test_dividir_mensaje_no_pierde_palabras():
+    texto = " ".join(f"palabra{i}" for i in range(500))
+    partes = dividir_mensaje(texto, limite=100)
+    assert all(len(p) <= 100 for p in partes)
+    assert " ".join(partes).split() == texto.split()
+
+
+@pytest.mark.parametrize("tasa", [0, -1, float("nan")])
+def test_token_bucket_rechaza_tasas_no_positivas(tasa):
+    with pytest.raises(ValueError):
+        TokenBucket(tasa)
+
+
+def test_token_bucket_con_tasa_menor_que_uno_no_se_bloquea():
+    bucket = TokenBucket(0.5)
+    inicio = time.monotonic()
+    bucket.adquirir()
+    assert time.monotonic() - inicio < 0.1
+
+    # Tras 2 s a 0.5 msg/s vuelve a haber un token disponible
+    bucket.ultimo -= 2.0
+    inicio = time.monotonic()
+    bucket.adquirir()
+    assert time.monotonic() - inicio < 0.1
+
+
+def test_token_bucket_permite_rafagas_hasta_la_tasa():
+    bucket = TokenBucket(50)
+    inicio = time.monotonic()
+    for _ in range(50):
+        bucket.adquirir()
+    assert time.monotonic() - inicio < 0.1
+    assert bucket.tokens < 1
+
+
+def test_envio_en_segundo_plano_registra_excepciones_inesperadas():
+    sender = WhatsAppSender("token", "123")
+    futuro = sender.enviar_en_segundo_plano("34600000000", None)  # content=None del modelo
+    with pytest.raises(TypeError):
+        futuro.result(timeout=5)
+    sender.executor.shutdown(wait=True)
+    assert sender.metricas()["fallidos"] == 1
+
+
+def test_solo_se_reintentan_429_y_errores_de_conexion():
+    reintentos = WhatsAppSender("token", "123").http.get_adapter("https://graph.facebook.com").max_retries
+    assert set(reintentos.status_forcelist) == {429}
+    assert reintentos.read == 0
+    assert reintentos.connect is None  # Limitado por 'total'
+
+
+def test_reenvios_descartados_se_cuentan():
+    sender = WhatsAppSender("token", "123")
+    sender.registrar_reenvio_descartado()
+    assert sender.metricas()["reenvios_descartados"] == 1
+
+
+def test_firma_del_webhook(monkeypatch):
+    monkeypatch.setattr(whatsapp, "WHATSAPP_APP_SECRET", "secreto")
+    cuerpo = b'{"entry": []}'
+    firma = "sha256=" + hmac.new(b"secreto", cuerpo, hashlib.sha256).hexdigest()
+
+    assert whatsapp.firma_valida(cuerpo, firma)
+    assert not whatsapp.firma_valida(cuerpo + b" ", firma)
+    assert not whatsapp.firma_valida(cuerpo, None)
+
+    monkeypatch.setattr(whatsapp, "WHATSAPP_APP_SECRET", None)
+    assert not whatsapp.firma_valida(cuerpo, firma)
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import requests
+
+from myapp.services import woocomerce_service
+from myapp.services.woocomerce_service import WooCommerceClient
+
+
+class _Pagina:
+    def __init__(self, productos, total_paginas):
+        self._productos = productos
+        self.headers = {"X-WP-TotalPages": str(total_paginas)}
+
+    def json(self):
+        if isinstance(self._productos, Exception):
+            raise self._productos
+        return self._productos
+
+
+def _cliente_con_tienda(monkeypatch, paginas, llamadas, espera=0):
+    cliente = WooCommerceClient()
+
+    def api_request(metodo, ruta, params=None, **kwargs):
+        llamadas.append(params["page"])
+        time.sleep(espera)
+        respuesta = paginas[params["page"] - 1]
+        if isinstance(respuesta, requests.RequestException):
+            raise respuesta
+        return _Pagina(respuesta, len(paginas))
+
+    monkeypatch.setattr(cliente, "_api_request", api_request)
+    return cliente
+
+
+def test_catalogo_pagina_y_se_cachea(monkeypatch):
+    llamadas = []
+    cliente = _cliente_con_tienda(monkeypatch, [[{"id": 1}], [{"id": 2}]], llamadas)
+
+    assert [p["id"] for p in cliente.obtener_productos()] == [1, 2]
+    assert [p["id"] for p in cliente.obtener_productos()] == [1, 2]
+    assert llamadas == [1, 2]
+
+
+def test_carga_inicial_concurrente_descarga_una_sola_vez(monkeypatch):
+    llamadas = []
+    cliente = _cliente_con_tienda(monkeypatch, [[{"id": 1}]], llamadas, espera=0.1)
+
+    hilos = [threading.Thread(target=cliente.obtener_productos) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert llamadas == [1]
+
+
+def test_catalogo_caducado_se_sirve_sin_esperar_y_se_mantiene_si_la_tienda_falla(monkeypatch):
+    llamadas = []
+    paginas = [[{"id": 1}]]
+    cliente = _cliente_con_tienda(monkeypatch, paginas, llamadas)
+    cliente.obtener_productos()
+
+    paginas[0] = requests.ConnectionError("tienda caída")
+    cliente._catalogo = (0, cliente._catalogo[1])  # Forzar caducidad
+    assert [p["id"] for p in cliente.obtener_productos()] == [1]
+
+    with cliente._lock_catalogo:  # Espera a que termine la recarga en segundo plano
+        pass
+    assert [p["id"] for p in cliente.obtener_productos()] == [1]
+    assert cliente._catalogo[0] > time.monotonic()  # No se reintenta en cada turno
+
+
+def test_error_en_la_carga_inicial_devuelve_catalogo_vacio_sin_reintentar_en_cada_turno(monkeypatch):
+    llamadas = []
+    paginas = [requests.Timeout("lenta")]
+    cliente = _cliente_con_tienda(monkeypatch, paginas, llamadas)
+
+    assert [cliente.obtener_productos() for _ in range(3)] == [[], [], []]
+    assert llamadas == [1]
+
+    paginas[0] = [{"id": 1}]
+    cliente._catalogo = (0, None)  # Pasa el tiempo de reintento
+    assert [p["id"] for p in cliente.obtener_productos()] == [1]
+    assert llamadas == [1, 1]
+
+
+def test_respuesta_que_no_es_json_mantiene_la_copia_anterior(monkeypatch):
+    llamadas = []
+    paginas = [[{"id": 1}]]
+    cliente = _cliente_con_tienda(monkeypatch, paginas, llamadas)
+    cliente.obtener_productos()
+
+    paginas[0] = ValueError("Expecting value: <html>")  # 200 con una página de error
+    cliente._catalogo = (0, cliente._catalogo[1])
+    with cliente._lock_catalogo:
+        cliente._refrescar_catalogo()
+    assert [p["id"] for p in cliente.obtener_productos()] == [1]
+    assert cliente._catalogo[0] > time.monotonic()
+
+
+def test_url_de_carrito():
+    url = woocomerce_service.get_add_to_cart_url(101, "robots", 2)
+    assert url.endswith("/product-category/robots/?add-to-cart=101&quantity=2")